@@ -1,36 +1,281 @@
+import time
+
+# Момент запуска процесса — от него считается время холодного старта (--measure-startup)
+STARTUP_STARTED = time.perf_counter()
+
 import logging
 import difflib
 import sqlite3
 from datetime import datetime
 import re
+import argparse
+import csv
+import io
+import atexit
+import json
+import queue
+import tempfile
+import threading
+import random
+import tracemalloc
+import zlib
+import hashlib
+import heapq
+import math
+from collections import Counter, OrderedDict
+from logging.handlers import QueueHandler, QueueListener
 import telebot
 from telebot import types
-from dotenv import load_dotenv
+from telebot.apihelper import ApiTelegramException
+from telebot.handler_backends import BaseMiddleware, CancelUpdate
+from dotenv import load_dotenv, dotenv_values
 import os
+from contextlib import contextmanager
+from datetime import timedelta
+
+# NumPy нужен только индексу дубликатов и импортируется лениво при прогреве (см. load_numpy)
+np = None
 
 load_dotenv()
 # Получаем переменные окружения
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 
+# Поиск семантических дубликатов: модель sentence-transformers (необязательно, только CPU),
+# порог косинусного сходства ее эмбеддингов и каталог для memmap-индекса векторов.
+# Без модели дубликаты ищутся через difflib со своим порогом DUPLICATE_DIFFLIB_THRESHOLD
+DUPLICATE_MODEL = os.getenv("DUPLICATE_MODEL")
+DUPLICATE_THRESHOLD = float(os.getenv("DUPLICATE_THRESHOLD", "0.85"))
+DUPLICATE_DIFFLIB_THRESHOLD = float(os.getenv("DUPLICATE_DIFFLIB_THRESHOLD", "0.8"))
+DUPLICATE_INDEX_DIR = os.getenv("DUPLICATE_INDEX_DIR", ".")
+
+# Архивирование: отвеченные вопросы старше ARCHIVE_AFTER_DAYS вместе с голосами
+# переносятся в архивные таблицы раз в ARCHIVE_INTERVAL_HOURS часов
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "365"))
+ARCHIVE_INTERVAL_HOURS = float(os.getenv("ARCHIVE_INTERVAL_HOURS", "24"))
+
+# Как часто планировщик проверяет, кому пора отправить сводку уведомлений (секунды)
+DIGEST_TICK_SECONDS = int(os.getenv("DIGEST_TICK_SECONDS", "60"))
+
+# Трендовые вопросы: вес голоса уменьшается вдвое каждые TRENDING_HALF_LIFE_HOURS часов
+TRENDING_HALF_LIFE_HOURS = float(os.getenv("TRENDING_HALF_LIFE_HOURS", "24"))
+
+# Как часто служебные счетчики (отрисовка меню, антифлуд, снимки БД) пишутся в лог (минуты, 0 — не писать)
+STATS_LOG_INTERVAL_MINUTES = float(os.getenv("STATS_LOG_INTERVAL_MINUTES", "60"))
+
+# Размер общего пула обработчиков в многоарендном режиме (--tenants)
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", "4"))
+
+# Логирование: LOG_FORMAT=text (как раньше) или json — один JSON-объект на строку.
+# Одинаковые debug-события прореживаются: пишется первое и каждое LOG_DEBUG_SAMPLE_EVERY-е
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_DEBUG_SAMPLE_EVERY = int(os.getenv("LOG_DEBUG_SAMPLE_EVERY", "100"))
+LOG_CONTEXT_FIELDS = ('tenant', 'request_id', 'chat_id', 'user_id')
+
+# Контекст логирования потока: идентификатор запроса, чат и пользователь обрабатываемого обновления
+log_local = threading.local()
+
+
+def log_context():
+    return getattr(log_local, 'context', None) or {}
+
+
+@contextmanager
+def logging_context(**fields):
+    previous = log_context()
+    log_local.context = {**previous, **fields}
+    try:
+        yield
+    finally:
+        log_local.context = previous
+
+
+# Добавляет к записи контекст потока, в котором она создана (до передачи в очередь)
+class LogContextFilter(logging.Filter):
+    def filter(self, record):
+        context = log_context()
+        record.tenant = current_tenant().name if len(tenants) > 1 else None
+        for field in LOG_CONTEXT_FIELDS[1:]:
+            setattr(record, field, context.get(field))
+        fields = [f"{field}={getattr(record, field)}" for field in LOG_CONTEXT_FIELDS
+                  if getattr(record, field) is not None]
+        record.context = f" [{' '.join(fields)}]" if fields else ''
+        return True
+
+
+# Прореживание debug-событий по шаблону сообщения (поэтому сообщения логируются с аргументами,
+# а не f-строками). Записи уровня INFO и выше проходят всегда
+class DebugSamplingFilter(logging.Filter):
+    def __init__(self, every):
+        super().__init__()
+        self.every = every
+        self.lock = threading.Lock()
+        self.counts = Counter()
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.every <= 1:
+            return True
+        with self.lock:
+            seen = self.counts[(record.name, record.msg)]
+            self.counts[(record.name, record.msg)] = seen + 1
+        record.sample_every = self.every
+        return seen % self.every == 0
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in LOG_CONTEXT_FIELDS + ('sample_every',):
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+# Запись передается в очередь как есть: сообщение форматируется уже в потоке QueueListener,
+# а не в потоке, обрабатывающем обновление
+class LogQueueHandler(QueueHandler):
+    def prepare(self, record):
+        return record
+
+
+def configure_logging():
+    output = logging.StreamHandler()
+    if LOG_FORMAT == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s%(context)s'))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = LogQueueHandler(log_queue)
+    queue_handler.addFilter(DebugSamplingFilter(LOG_DEBUG_SAMPLE_EVERY))
+    queue_handler.addFilter(LogContextFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+    # telebot пишет в stderr собственным обработчиком в обход очереди и формата;
+    # без него его записи доходят до корневого логгера
+    telebot.logger.handlers.clear()
+
+    listener = QueueListener(log_queue, output)
+    listener.start()
+    atexit.register(listener.stop)
+
+
 # Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+configure_logging()
 logger = logging.getLogger(__name__)
 
-# Инициализация бота
-bot = telebot.TeleBot(BOT_TOKEN)
+# Арендатор — отдельный «Совет старейшин» со своим ботом и каталогом данных (БД, список
+# запрещенных слов, индекс дубликатов). Настройки — .env каталога поверх окружения процесса.
+# Соединения с БД, снимок для чтения и индекс дубликатов у каждого арендатора свои
+class Tenant:
+    def __init__(self, name, directory='', settings=None):
+        self.name = name
+        self.directory = directory
+        self.settings = dict(os.environ if settings is None else settings)
+        self.bot = None
+        self.db_path = os.path.join(directory, 'elders_council.db')
+        self.bad_words_path = os.path.join(directory, 'true_list.txt')
+        # (mtime файла, скомпилированный фильтр из общего кэша bad_words_patterns)
+        self.bad_words = (None, None)
+        self.write_lock = threading.Lock()
+        self.writer_connection = None
+        self.read_local = threading.local()
+        self.snapshot_lock = threading.Lock()
+        # (поколение, URI снимка, соединение, удерживающее снимок в памяти, момент снятия)
+        self.current_snapshot = (0, None, None, float('-inf'))
+        self.snapshot_refreshing = False
+        # Соединения потоков со снимками: идентификатор потока -> (поколение, соединение, момент выдачи)
+        self.snapshot_readers = {}
+        self.snapshot_stats = Counter()
+        self.render_stats = Counter()
+        self.throttle_middleware = None
+        self.duplicate_index = None
+        self.trending = None
+
+    def setting(self, name, default=None):
+        return self.settings.get(name) or default
+
+
+# Арендатор, чье обновление обрабатывает текущий поток. Вне обработчиков (одиночный режим,
+# замеры, CLI) — арендатор по умолчанию: текущий каталог и окружение процесса
+tenant_local = threading.local()
+default_tenant = Tenant('default')
+tenants = [default_tenant]
+
+
+def current_tenant():
+    return getattr(tenant_local, 'tenant', None) or default_tenant
+
+
+@contextmanager
+def use_tenant(tenant):
+    previous = getattr(tenant_local, 'tenant', None)
+    tenant_local.tenant = tenant
+    try:
+        yield tenant
+    finally:
+        tenant_local.tenant = previous
+
+
+# Бот текущего арендатора. Обработчики регистрируются на боте арендатора по умолчанию,
+# боты остальных арендаторов используют те же списки обработчиков (см. create_tenant_bot)
+class TenantBot:
+    def __getattr__(self, name):
+        return getattr(current_tenant().bot, name)
+
+    # Продолжение диалога (следующее сообщение пользователя) логируется с тем же
+    # идентификатором запроса, что и обработчик, который его зарегистрировал
+    def register_next_step_handler(self, message, callback, *args, **kwargs):
+        request_id = log_context().get('request_id')
+
+        def continuation(next_message, *step_args, **step_kwargs):
+            with logging_context(request_id=request_id, chat_id=next_message.chat.id,
+                                 user_id=next_message.from_user.id):
+                return callback(next_message, *step_args, **step_kwargs)
+
+        current_tenant().bot.register_next_step_handler(message, continuation, *args, **kwargs)
+
+
+# Инициализация бота. Без BOT_TOKEN бот по умолчанию нужен только как реестр обработчиков
+# для режима --tenants, поэтому токен проверяется, лишь когда он задан
+default_tenant.bot = telebot.TeleBot(BOT_TOKEN or '', use_class_middlewares=True, validate_token=bool(BOT_TOKEN))
+bot = TenantBot()
 
 # Глобальная переменная для хранения ID последнего меню
 current_menu_message_id = None
 
+# Версия схемы БД (PRAGMA user_version). Увеличивается при каждом изменении DDL в init_db
+SCHEMA_VERSION = 6
 
-# Инициализация базы данных
+# Длительность этапов запуска и прогрева, секунды
+startup_timings = {}
+
+
+# Инициализация базы данных. Если версия схемы совпадает, DDL не выполняется.
+# Возвращает True, если схема создавалась или обновлялась
 def init_db():
-    conn = sqlite3.connect('elders_council.db', check_same_thread=False)
+    conn = sqlite3.connect(current_tenant().db_path, check_same_thread=False)
     cursor = conn.cursor()
 
+    # WAL: читатели не блокируют единственного писателя и не ждут его
+    cursor.execute('PRAGMA journal_mode=WAL')
+
+    cursor.execute('PRAGMA user_version')
+    version = cursor.fetchone()[0]
+    if version == SCHEMA_VERSION:
+        conn.close()
+        return False
+
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS users (
         user_id INTEGER PRIMARY KEY,
@@ -81,65 +326,1374 @@ def init_db():
         FOREIGN KEY (question_id) REFERENCES questions (question_id)
     )''')
 
+    # Индексы для горячих запросов: списки вопросов, топ и пересчет голосов
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_questions_approved_timestamp ON questions (is_approved, timestamp)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_questions_approved_votes ON questions (is_approved, votes)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_votes_question ON user_votes (question_id)')
+
+    # Архив старых отвеченных вопросов и их голосов (те же столбцы, без внешних ключей)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS questions_archive (
+        question_id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        question_text TEXT,
+        is_approved BOOLEAN,
+        is_answered BOOLEAN,
+        timestamp TIMESTAMP,
+        votes INTEGER DEFAULT 0
+    )''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS user_votes_archive (
+        user_id INTEGER,
+        question_id INTEGER,
+        vote_type TEXT,
+        PRIMARY KEY (user_id, question_id)
+    )''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS archive_runs (
+        run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        run_at TIMESTAMP,
+        cutoff TIMESTAMP,
+        questions_moved INTEGER,
+        votes_moved INTEGER
+    )''')
+
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_questions_archive_timestamp ON questions_archive (timestamp)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_questions_archive_votes ON questions_archive (votes)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_votes_archive_question ON user_votes_archive (question_id)')
+
+    # Сводки уведомлений: интервал в минутах (0 — присылать сразу) и указатель на последнее
+    # доставленное событие. События только дописываются и удаляются после доставки
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS notification_settings (
+        user_id INTEGER PRIMARY KEY,
+        digest_interval INTEGER DEFAULT 0,
+        last_event_id INTEGER DEFAULT 0,
+        next_digest_at TIMESTAMP
+    )''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS notification_events (
+        event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        kind TEXT,
+        question_id INTEGER,
+        text TEXT,
+        created_at TIMESTAMP
+    )''')
+
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_notification_events_user ON notification_events (user_id, event_id)')
+
+    # Журнал голосов: только дописывается, по событию на каждое изменение голоса.
+    # delta_up/delta_down — изменение числа голосов «за»/«против», created_at — unix-время
+    # (число, чтобы весь журнал векторизовался без разбора дат)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS vote_events (
+        event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        question_id INTEGER,
+        user_id INTEGER,
+        vote_type TEXT,
+        delta_up INTEGER,
+        delta_down INTEGER,
+        created_at REAL
+    )''')
+
+    # Результат офлайн-пересчета (--recompute-scores): агрегаты по вопросам на момент last_event_id.
+    # hot считается относительно epoch запуска, с которого движок трендов продолжает при старте
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS question_scores (
+        question_id INTEGER PRIMARY KEY,
+        upvotes INTEGER,
+        downvotes INTEGER,
+        wilson REAL,
+        hot REAL
+    )''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS score_runs (
+        run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        run_at TIMESTAMP,
+        epoch REAL,
+        half_life_hours REAL,
+        last_event_id INTEGER,
+        events INTEGER,
+        questions INTEGER
+    )''')
+
+    # Голоса, поданные до появления журнала, переносятся в него один раз. Время голоса
+    # не хранилось, поэтому берется время вопроса. timestamp записан в местном времени,
+    # модификатор 'utc' переводит его в эпоху так же, как time.time() в apply_vote
+    if version < 4:
+        for questions_table, votes_table in (('questions', 'user_votes'),
+                                             ('questions_archive', 'user_votes_archive')):
+            cursor.execute(f'''
+            INSERT INTO vote_events (question_id, user_id, vote_type, delta_up, delta_down, created_at)
+            SELECT v.question_id, v.user_id, v.vote_type, v.vote_type = 'up', v.vote_type = 'down',
+                   COALESCE(CAST(strftime('%s', q.timestamp, 'utc') AS REAL), 0)
+            FROM {votes_table} v JOIN {questions_table} q ON q.question_id = v.question_id
+            ORDER BY q.timestamp
+            ''')
+
+    # Роллапы для /stats: счетчики по дням, по экспертам и общие. Обновляются обработчиками
+    # в той же транзакции, что и данные, поэтому панель читает несколько строк по ключу
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS daily_stats (
+        day TEXT PRIMARY KEY,
+        questions_asked INTEGER DEFAULT 0,
+        questions_approved INTEGER DEFAULT 0,
+        questions_rejected INTEGER DEFAULT 0,
+        answers INTEGER DEFAULT 0,
+        first_answers INTEGER DEFAULT 0,
+        first_answer_latency REAL DEFAULT 0,
+        votes INTEGER DEFAULT 0,
+        votes_up INTEGER DEFAULT 0,
+        votes_down INTEGER DEFAULT 0,
+        vote_changes INTEGER DEFAULT 0,
+        vote_retractions INTEGER DEFAULT 0
+    )''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS expert_stats (
+        user_id INTEGER PRIMARY KEY,
+        answers INTEGER DEFAULT 0,
+        answer_latency REAL DEFAULT 0,
+        max_answer_latency REAL DEFAULT 0,
+        last_answer_at TIMESTAMP
+    )''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS stat_counters (
+        name TEXT PRIMARY KEY,
+        value INTEGER DEFAULT 0
+    )''')
+
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_expert_stats_answers ON expert_stats (answers)')
+
+    # Существующие данные сворачиваются в роллапы один раз. Время одобрения не хранилось,
+    # поэтому одобрение считается в день вопроса; отклоненные вопросы удалены и не восстанавливаются
+    if version < 5:
+        backfill_stats(cursor)
+
+    # До версии 6 в votes считалось любое изменение голоса, включая отзыв и смену «за» на «против».
+    # Голосовые столбцы пересчитываются из журнала голосов
+    if 5 <= version < 6:
+        cursor.execute('ALTER TABLE daily_stats ADD COLUMN vote_changes INTEGER DEFAULT 0')
+        cursor.execute('ALTER TABLE daily_stats ADD COLUMN vote_retractions INTEGER DEFAULT 0')
+        cursor.execute('UPDATE daily_stats SET votes = 0, votes_up = 0, votes_down = 0')
+        backfill_vote_stats(cursor)
+
+    cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
     conn.commit()
     conn.close()
+    return True
+
+
+def backfill_stats(cursor):
+    all_questions = '''
+    SELECT question_id, is_approved, timestamp FROM questions
+    UNION ALL
+    SELECT question_id, is_approved, timestamp FROM questions_archive
+    '''
+    cursor.execute(f'''
+    INSERT INTO daily_stats (day, questions_asked, questions_approved)
+    SELECT date(timestamp), COUNT(*), SUM(is_approved) FROM ({all_questions}) GROUP BY date(timestamp)
+    ''')
+
+    cursor.execute('''
+    INSERT INTO daily_stats (day, answers)
+    SELECT date(timestamp), COUNT(*) FROM answers WHERE true GROUP BY date(timestamp)
+    ON CONFLICT (day) DO UPDATE SET answers = excluded.answers
+    ''')
+
+    # Первый ответ на вопрос и задержка от вопроса до него
+    cursor.execute(f'''
+    INSERT INTO daily_stats (day, first_answers, first_answer_latency)
+    SELECT date(first_at), COUNT(*), SUM((julianday(first_at) - julianday(q.timestamp)) * 86400)
+    FROM (SELECT question_id, MIN(timestamp) AS first_at FROM answers GROUP BY question_id) a
+    JOIN ({all_questions}) q ON q.question_id = a.question_id
+    WHERE true GROUP BY date(first_at)
+    ON CONFLICT (day) DO UPDATE SET first_answers = excluded.first_answers,
+                                    first_answer_latency = excluded.first_answer_latency
+    ''')
+
+    backfill_vote_stats(cursor)
+
+    cursor.execute(f'''
+    INSERT INTO expert_stats (user_id, answers, answer_latency, max_answer_latency, last_answer_at)
+    SELECT a.user_id, COUNT(*), SUM(latency), MAX(latency), MAX(a.timestamp)
+    FROM (SELECT a.user_id, a.timestamp, (julianday(a.timestamp) - julianday(q.timestamp)) * 86400 AS latency
+          FROM answers a JOIN ({all_questions}) q ON q.question_id = a.question_id) a
+    GROUP BY a.user_id
+    ''')
+
+    cursor.execute('''
+    INSERT INTO stat_counters (name, value) SELECT 'moderation_backlog', COUNT(*) FROM moderation_queue
+    ''')
+
+
+# Голоса по дням из журнала. Сумма дельт события: 1 — новый голос, 0 — смена «за» на «против»
+# или обратно, -1 — отзыв голоса. В votes попадают только новые голоса, поэтому votes = votes_up + votes_down
+def backfill_vote_stats(cursor):
+    cursor.execute('''
+    INSERT INTO daily_stats (day, votes, votes_up, votes_down, vote_changes, vote_retractions)
+    SELECT date(created_at, 'unixepoch', 'localtime'), SUM(delta_up + delta_down = 1),
+           SUM(delta_up = 1 AND delta_down = 0), SUM(delta_down = 1 AND delta_up = 0),
+           SUM(delta_up + delta_down = 0), SUM(delta_up + delta_down = -1)
+    FROM vote_events WHERE true GROUP BY date(created_at, 'unixepoch', 'localtime')
+    ON CONFLICT (day) DO UPDATE SET votes = excluded.votes, votes_up = excluded.votes_up,
+                                    votes_down = excluded.votes_down, vote_changes = excluded.vote_changes,
+                                    vote_retractions = excluded.vote_retractions
+    ''')
+
+
+# Инкремент роллапов текущего дня. Имена столбцов задаются только в коде
+def bump_daily_stats(cursor, **amounts):
+    columns = ', '.join(amounts)
+    updates = ', '.join(f'{column} = {column} + excluded.{column}' for column in amounts)
+    cursor.execute(f'''
+    INSERT INTO daily_stats (day, {columns}) VALUES (?{', ?' * len(amounts)})
+    ON CONFLICT (day) DO UPDATE SET {updates}
+    ''', (datetime.now().date().isoformat(), *amounts.values()))
+
+
+def bump_counter(cursor, name, amount=1):
+    cursor.execute('''
+    INSERT INTO stat_counters (name, value) VALUES (?, ?)
+    ON CONFLICT (name) DO UPDATE SET value = value + excluded.value
+    ''', (name, amount))
+
+
+# Все записи идут через одно соединение-писатель арендатора под блокировкой. Внутри блока нельзя
+# обращаться к Telegram: блокировка держится до коммита
+@contextmanager
+def write_connection():
+    tenant = current_tenant()
+    with tenant.write_lock:
+        if tenant.writer_connection is None:
+            tenant.writer_connection = sqlite3.connect(tenant.db_path, check_same_thread=False, timeout=30)
+        try:
+            yield tenant.writer_connection
+            tenant.writer_connection.commit()
+        except Exception:
+            tenant.writer_connection.rollback()
+            raise
+
+
+# Чтение. Каждое место чтения указывает, насколько устаревшие данные ему допустимы:
+# max_staleness=0 — свежие данные из файла через соединение только для чтения (своё у каждого потока);
+# max_staleness>0 — снимок БД в памяти, снятый backup API. Устаревший снимок обновляется в фоне,
+# а пока он копируется, такие чтения идут из файла — запрос не ждет копирования всей БД.
+# Соединения потока хранятся у арендатора: общий пул обрабатывает обновления разных арендаторов
+SNAPSHOT_READER_IDLE_SECONDS = 10
+
+
+def refresh_snapshot(tenant):
+    generation = tenant.current_snapshot[0] + 1
+    uri = f'file:elders_snapshot_{os.getpid()}_{id(tenant)}_{generation}?mode=memory&cache=shared'
+    anchor = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    source = sqlite3.connect(tenant.db_path)
+    source.backup(anchor)
+    source.close()
+
+    with tenant.snapshot_lock:
+        previous_anchor = tenant.current_snapshot[2]
+        tenant.current_snapshot = (generation, uri, anchor, time.monotonic())
+        if previous_anchor is not None:
+            previous_anchor.close()
+        # Соединение потока со старым снимком держит в памяти всю его копию. Потоки, читавшие недавно,
+        # сами переключатся при следующем чтении; простаивающие закрываются здесь
+        now = time.monotonic()
+        for ident, (reader_generation, conn, handed_out) in list(tenant.snapshot_readers.items()):
+            if reader_generation != generation and now - handed_out > SNAPSHOT_READER_IDLE_SECONDS:
+                conn.close()
+                del tenant.snapshot_readers[ident]
+    tenant.snapshot_stats['refreshed'] += 1
+
+
+def run_snapshot_refresh(tenant):
+    try:
+        with use_tenant(tenant):
+            refresh_snapshot(tenant)
+    except sqlite3.Error as e:
+        logger.error("Не удалось обновить снимок БД арендатора %s: %s", tenant.name, e)
+    finally:
+        tenant.snapshot_refreshing = False
+
+
+def schedule_snapshot_refresh(tenant):
+    with tenant.snapshot_lock:
+        if tenant.snapshot_refreshing:
+            return
+        tenant.snapshot_refreshing = True
+    threading.Thread(target=run_snapshot_refresh, args=(tenant,), name=f'snapshot-{tenant.name}',
+                     daemon=True).start()
+
+
+def get_read_connection(max_staleness=0):
+    tenant = current_tenant()
+    if max_staleness > 0:
+        if time.monotonic() - tenant.current_snapshot[3] > max_staleness:
+            schedule_snapshot_refresh(tenant)
+            tenant.snapshot_stats['read_from_file'] += 1
+        else:
+            ident = threading.get_ident()
+            # Подключение под блокировкой: обновление не закроет снимок между чтением URI и подключением
+            with tenant.snapshot_lock:
+                generation, uri, _, _ = tenant.current_snapshot
+                reader = tenant.snapshot_readers.get(ident)
+                if reader is not None and reader[0] == generation:
+                    conn = reader[1]
+                else:
+                    if reader is not None:
+                        reader[1].close()
+                    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+                tenant.snapshot_readers[ident] = (generation, conn, time.monotonic())
+            return conn
+
+    read_local = tenant.read_local
+    conn = getattr(read_local, 'file_connection', None)
+    if conn is None:
+        conn = sqlite3.connect(tenant.db_path, check_same_thread=False, timeout=30)
+        conn.execute('PRAGMA query_only = ON')
+        read_local.file_connection = conn
+    return conn
+
+
+# Закрытие соединений писателя, читателей и снимка (при смене файла БД в замерах)
+def close_connections():
+    tenant = current_tenant()
+    with tenant.write_lock:
+        if tenant.writer_connection is not None:
+            tenant.writer_connection.close()
+            tenant.writer_connection = None
+    conn = getattr(tenant.read_local, 'file_connection', None)
+    if conn is not None:
+        conn.close()
+        tenant.read_local.file_connection = None
+    # Фоновое копирование старого файла не должно опубликовать снимок после закрытия
+    while tenant.snapshot_refreshing:
+        time.sleep(0.01)
+    with tenant.snapshot_lock:
+        for _, conn, _ in tenant.snapshot_readers.values():
+            conn.close()
+        tenant.snapshot_readers.clear()
+        if tenant.current_snapshot[2] is not None:
+            tenant.current_snapshot[2].close()
+        tenant.current_snapshot = (tenant.current_snapshot[0], None, None, float('-inf'))
 
 
 # Проверка пользовательского соглашения
 def check_agreement(user_id):
-    conn = sqlite3.connect('elders_council.db', check_same_thread=False)
-    cursor = conn.cursor()
+    cursor = get_read_connection(max_staleness=0).cursor()
     cursor.execute('SELECT agreement_accepted FROM users WHERE user_id = ?', (user_id,))
     result = cursor.fetchone()
-    conn.close()
     return result and result[0]
 
 
+# Скомпилированные фильтры запрещенных слов по хешу содержимого списка: арендаторы с одинаковым
+# списком используют одно регулярное выражение. Фильтр компилируется при прогреве или первом
+# использовании и пересобирается при изменении файла
+bad_words_patterns = {}
+bad_words_lock = threading.Lock()
+
+
+def get_bad_words_pattern():
+    tenant = current_tenant()
+    mtime = os.path.getmtime(tenant.bad_words_path)
+    if tenant.bad_words[0] != mtime:
+        with bad_words_lock:
+            if tenant.bad_words[0] != mtime:
+                with open(tenant.bad_words_path, 'rb') as f:
+                    content = f.read()
+                digest = hashlib.sha256(content).digest()
+                pattern = bad_words_patterns.get(digest)
+                if pattern is None:
+                    bad_words = [line.strip() for line in content.decode('utf-8').splitlines() if line.strip()]
+                    pattern = re.compile(r'\b(' + '|'.join(map(re.escape, bad_words)) + r')\b', re.IGNORECASE)
+                    bad_words_patterns[digest] = pattern
+                tenant.bad_words = (mtime, pattern)
+    return tenant.bad_words[1]
+
+
 # Проверка на запрещенные слова
 def contains_bad_words(text: str) -> bool:
     try:
-        with open("true_list.txt", encoding="UTF-8") as f:
-            bad_words = [line.strip() for line in f.readlines() if line.strip()]
-
-        pattern = re.compile(r'\b(' + '|'.join(map(re.escape, bad_words)) + r')\b', re.IGNORECASE)
-        return bool(pattern.search(text))
+        return bool(get_bad_words_pattern().search(text))
     except Exception as e:
-        logger.error(f"Ошибка при чтении файла запрещенных слов: {e}")
+        logger.error("Ошибка при чтении файла запрещенных слов: %s", e)
         return False
 
 
+# Векторный индекс одобренных вопросов для поиска дубликатов.
+# Векторы нормированы, поэтому косинусное сходство — это скалярное произведение.
+# Матрица, идентификаторы и хеши текстов хранятся в memmap-файлах .npy и переживают перезапуск;
+# по хешам при прогреве находятся строки, которые больше не совпадают с БД.
+class DuplicateIndex:
+    SEARCH_CHUNK = 32768
+
+    def __init__(self, path, dim):
+        self.path = path
+        self.dim = dim
+        self.lock = threading.Lock()
+        self.count = 0
+        self.ids = None
+        self.vectors = None
+        self.hashes = None
+        # question_id -> хеш текста, по которому построен вектор
+        self.known_ids = {}
+
+    def _ids_path(self):
+        return self.path + '.ids.npy'
+
+    def _vectors_path(self):
+        return self.path + '.vec.npy'
+
+    def _hashes_path(self):
+        return self.path + '.hash.npy'
+
+    def open(self, capacity=1024):
+        with self.lock:
+            paths = (self._ids_path(), self._vectors_path(), self._hashes_path())
+            if all(os.path.exists(path) for path in paths):
+                try:
+                    ids, vectors, hashes = (np.load(path, mmap_mode='r+') for path in paths)
+                    if (vectors.ndim == 2 and vectors.shape[1] == self.dim
+                            and len(ids) == len(vectors) == len(hashes)):
+                        self.ids, self.vectors, self.hashes = ids, vectors, hashes
+                        # Строки заполняются последовательно, свободные помечены -1
+                        self.count = int(np.count_nonzero(ids >= 0))
+                        self.known_ids = dict(zip(ids[:self.count].tolist(), hashes[:self.count].tolist()))
+                        return
+                    logger.warning("Индекс дубликатов %s не совпадает по размерности, пересоздаём", self.path)
+                except (ValueError, OSError) as e:
+                    logger.warning("Не удалось открыть индекс дубликатов %s: %s", self.path, e)
+            self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        ids_tmp = self._ids_path() + '.tmp'
+        vectors_tmp = self._vectors_path() + '.tmp'
+        hashes_tmp = self._hashes_path() + '.tmp'
+        ids = np.lib.format.open_memmap(ids_tmp, mode='w+', dtype=np.int64, shape=(capacity,))
+        vectors = np.lib.format.open_memmap(vectors_tmp, mode='w+', dtype=np.float32, shape=(capacity, self.dim))
+        hashes = np.lib.format.open_memmap(hashes_tmp, mode='w+', dtype=np.int64, shape=(capacity,))
+        ids[:] = -1
+        if self.count:
+            ids[:self.count] = self.ids[:self.count]
+            vectors[:self.count] = self.vectors[:self.count]
+            hashes[:self.count] = self.hashes[:self.count]
+        ids.flush()
+        vectors.flush()
+        hashes.flush()
+        del ids, vectors, hashes
+        # Старые отображения нужно закрыть до замены файлов (иначе Windows не даст их перезаписать)
+        self.ids = self.vectors = self.hashes = None
+        os.replace(ids_tmp, self._ids_path())
+        os.replace(vectors_tmp, self._vectors_path())
+        os.replace(hashes_tmp, self._hashes_path())
+        self.ids = np.load(self._ids_path(), mmap_mode='r+')
+        self.vectors = np.load(self._vectors_path(), mmap_mode='r+')
+        self.hashes = np.load(self._hashes_path(), mmap_mode='r+')
+
+    def add(self, question_ids, vectors, hashes):
+        with self.lock:
+            rows = [(q_id, vec, text_hash) for q_id, vec, text_hash in zip(question_ids, vectors, hashes)
+                    if q_id not in self.known_ids]
+            if not rows:
+                return
+            needed = self.count + len(rows)
+            if needed > len(self.ids):
+                capacity = len(self.ids)
+                while capacity < needed:
+                    capacity *= 2
+                self._allocate(capacity)
+            start = self.count
+            self.ids[start:needed] = [q_id for q_id, _, _ in rows]
+            self.vectors[start:needed] = np.asarray([vec for _, vec, _ in rows], dtype=np.float32)
+            self.hashes[start:needed] = [text_hash for _, _, text_hash in rows]
+            self.ids.flush()
+            self.vectors.flush()
+            self.hashes.flush()
+            self.count = needed
+            self.known_ids.update((q_id, text_hash) for q_id, _, text_hash in rows)
+
+    # Удаление строк с уплотнением: оставшиеся сдвигаются к началу, свободный хвост помечается -1
+    def remove(self, question_ids):
+        with self.lock:
+            removed = [q_id for q_id in question_ids if self.known_ids.pop(q_id, None) is not None]
+            if not removed:
+                return 0
+            keep = np.flatnonzero(~np.isin(self.ids[:self.count], removed))
+            kept = len(keep)
+            self.ids[:kept] = self.ids[keep]
+            self.vectors[:kept] = self.vectors[keep]
+            self.hashes[:kept] = self.hashes[keep]
+            self.ids[kept:self.count] = -1
+            self.ids.flush()
+            self.vectors.flush()
+            self.hashes.flush()
+            self.count = kept
+            return len(removed)
+
+    # Для каждого вектора запроса возвращает (question_id, сходство) ближайшего вопроса
+    def search(self, query_vectors):
+        query_vectors = np.atleast_2d(np.asarray(query_vectors, dtype=np.float32))
+        best_scores = np.full(len(query_vectors), -1.0, dtype=np.float32)
+        best_rows = np.full(len(query_vectors), -1, dtype=np.int64)
+        with self.lock:
+            count, vectors, ids = self.count, self.vectors, self.ids
+        for start in range(0, count, self.SEARCH_CHUNK):
+            chunk = vectors[start:min(start + self.SEARCH_CHUNK, count)]
+            scores = query_vectors @ chunk.T
+            rows = scores.argmax(axis=1)
+            chunk_best = scores[np.arange(len(query_vectors)), rows]
+            better = chunk_best > best_scores
+            best_scores[better] = chunk_best[better]
+            best_rows[better] = rows[better] + start
+        return [
+            (int(ids[row]), float(score)) if row >= 0 else (None, 0.0)
+            for row, score in zip(best_rows, best_scores)
+        ]
+
+
+NGRAM_DIM = 512
+WORD_RE = re.compile(r'\w+')
+# Модель общая для всех арендаторов и загружается один раз
+duplicate_model = None
+duplicate_model_loaded = False
+duplicate_model_lock = threading.Lock()
+
+
+# Хеш текста вопроса для сверки индекса с БД
+def question_text_hash(text):
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little', signed=True)
+
+
+# Векторизатор без внешних моделей: хеширование символьных 3- и 4-грамм слов со знаком.
+# Порог для него не откалиброван (общие начала вопросов дают высокое сходство), поэтому
+# он используется только в замере скорости индекса, а не для поиска дубликатов
+def ngram_vector(text):
+    indices = []
+    signs = []
+    for word in WORD_RE.findall(text.lower().replace('ё', 'е')):
+        padded = f' {word} '
+        for n in (3, 4):
+            for i in range(len(padded) - n + 1):
+                h = zlib.crc32(padded[i:i + n].encode('utf-8'))
+                indices.append(h % NGRAM_DIM)
+                signs.append(1.0 if h & 0x80000000 else -1.0)
+    vector = np.bincount(indices, weights=signs, minlength=NGRAM_DIM).astype(np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+# Векторизация пачки текстов моделью (или n-граммами для замера без модели)
+def embed_questions(texts):
+    if duplicate_model is not None:
+        return duplicate_model.encode(list(texts), batch_size=64, normalize_embeddings=True,
+                                      convert_to_numpy=True).astype(np.float32)
+    if not texts:
+        return np.zeros((0, NGRAM_DIM), dtype=np.float32)
+    return np.vstack([ngram_vector(text) for text in texts])
+
+
+# Пороги заданы отдельно: косинус эмбеддингов и отношение difflib измеряются в разных шкалах
+def get_duplicate_threshold():
+    return float(current_tenant().setting('DUPLICATE_THRESHOLD', DUPLICATE_THRESHOLD))
+
+
+def get_difflib_threshold():
+    return float(current_tenant().setting('DUPLICATE_DIFFLIB_THRESHOLD', DUPLICATE_DIFFLIB_THRESHOLD))
+
+
+def load_duplicate_model():
+    if not DUPLICATE_MODEL:
+        return None
+    try:
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(DUPLICATE_MODEL, device='cpu')
+    except Exception as e:
+        logger.warning("Не удалось загрузить модель %s, используем difflib: %s", DUPLICATE_MODEL, e)
+        return None
+
+
+def load_numpy():
+    global np
+    if np is None:
+        try:
+            import numpy
+            np = numpy
+        except ImportError:
+            pass
+    return np
+
+
+# Загрузка индекса, сверка с БД и досчёт векторов для одобренных вопросов, которых в нём ещё нет.
+# Индекс строится только для модели; без нее остается difflib
+def init_duplicate_index():
+    global duplicate_model, duplicate_model_loaded
+    if load_numpy() is None:
+        logger.warning("NumPy не установлен, поиск дубликатов работает через difflib")
+        return
+
+    with duplicate_model_lock:
+        if not duplicate_model_loaded:
+            duplicate_model = load_duplicate_model()
+            duplicate_model_loaded = True
+    if duplicate_model is None:
+        logger.info("Модель для дубликатов не задана, поиск дубликатов работает через difflib")
+        return
+
+    tenant = current_tenant()
+    dim = duplicate_model.get_sentence_embedding_dimension()
+    name = re.sub(r'\W+', '_', DUPLICATE_MODEL)
+    index_dir = os.path.join(tenant.directory, tenant.setting('DUPLICATE_INDEX_DIR', DUPLICATE_INDEX_DIR))
+    index = DuplicateIndex(os.path.join(index_dir, f'question_vectors_{name}'), dim)
+    index.open()
+
+    cursor = get_read_connection(max_staleness=0).cursor()
+    cursor.execute('''
+    SELECT question_id, question_text FROM questions WHERE is_approved = TRUE
+    UNION ALL
+    SELECT question_id, question_text FROM questions_archive
+    ''')
+    rows = cursor.fetchall()
+    current = {q_id: question_text_hash(q_text) for q_id, q_text in rows}
+
+    # Строки вопросов, которых больше нет в БД (отклонены, БД пересоздана) или чей текст изменился
+    stale = [q_id for q_id, text_hash in index.known_ids.items() if current.get(q_id) != text_hash]
+    index.remove(stale)
+    missing = [row for row in rows if row[0] not in index.known_ids]
+
+    for start in range(0, len(missing), 1000):
+        batch = missing[start:start + 1000]
+        texts = [q_text for _, q_text in batch]
+        index.add([q_id for q_id, _ in batch], embed_questions(texts), [question_text_hash(t) for t in texts])
+
+    tenant.duplicate_index = index
+    logger.info("Индекс дубликатов готов: %s вопросов, добавлено %s, удалено устаревших %s",
+                index.count, len(missing), len(stale))
+
+
+def add_question_to_index(question_id, question_text):
+    duplicate_index = current_tenant().duplicate_index
+    if duplicate_index is None:
+        return
+    try:
+        duplicate_index.add([question_id], embed_questions([question_text]), [question_text_hash(question_text)])
+    except Exception as e:
+        logger.error("Не удалось добавить вопрос %s в индекс дубликатов: %s", question_id, e)
+
+
+def remove_question_from_index(question_id):
+    duplicate_index = current_tenant().duplicate_index
+    if duplicate_index is None:
+        return
+    try:
+        duplicate_index.remove([question_id])
+    except Exception as e:
+        logger.error("Не удалось удалить вопрос %s из индекса дубликатов: %s", question_id, e)
+
+
 # Проверка на дубликаты вопросов
 def is_duplicate_question(question_text: str) -> bool:
-    conn = sqlite3.connect('elders_council.db', check_same_thread=False)
-    cursor = conn.cursor()
-    cursor.execute('SELECT question_text FROM questions WHERE is_approved = TRUE')
+    duplicate_index = current_tenant().duplicate_index
+    if duplicate_index is not None:
+        question_id, similarity = duplicate_index.search(embed_questions([question_text]))[0]
+        if similarity >= get_duplicate_threshold():
+            logger.debug("Найден дубликат вопроса %s (сходство %.2f)", question_id, similarity)
+            return True
+        return False
+
+    cursor = get_read_connection(max_staleness=30).cursor()
+    cursor.execute('''
+    SELECT question_text FROM questions WHERE is_approved = TRUE
+    UNION ALL
+    SELECT question_text FROM questions_archive
+    ''')
     existing_questions = [row[0] for row in cursor.fetchall()]
-    conn.close()
 
+    threshold = get_difflib_threshold()
     for existing in existing_questions:
         similarity = difflib.SequenceMatcher(None, question_text.lower(), existing.lower()).ratio()
-        if similarity > 0.8:
+        if similarity > threshold:
             return True
     return False
 
 
+# Замер скорости поиска дубликатов на синтетической базе вопросов. Без модели индекс
+# заполняется n-граммами: измеряется только скорость поиска, а не качество
+def benchmark_duplicates(total=100_000, queries=200):
+    if load_numpy() is None:
+        print("Для замера нужен NumPy")
+        return
+
+    words = ['как', 'где', 'когда', 'почему', 'можно', 'получить', 'найти', 'сдать', 'перевестись',
+             'стипендию', 'общежитие', 'сессию', 'практику', 'кафедру', 'диплом', 'зачёт', 'экзамен',
+             'расписание', 'лабораторию', 'библиотеку', 'конференцию', 'грант', 'магистратуру',
+             'аспирантуру', 'преподавателя', 'декана', 'факультет', 'бурения', 'нефти', 'газа',
+             'трубопровода', 'месторождения', 'химии', 'физики', 'математики', 'проекта', 'курсовой']
+    rng = random.Random(42)
+
+    def make_question():
+        return ' '.join(rng.choice(words) for _ in range(rng.randint(5, 12))) + '?'
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index = DuplicateIndex(os.path.join(tmp, 'bench'), NGRAM_DIM if duplicate_model is None
+                               else duplicate_model.get_sentence_embedding_dimension())
+        index.open(capacity=total)
+
+        started = time.perf_counter()
+        for start in range(0, total, 5000):
+            batch = [make_question() for _ in range(min(5000, total - start))]
+            index.add(range(start, start + len(batch)), embed_questions(batch), [question_text_hash(q) for q in batch])
+        build_time = time.perf_counter() - started
+
+        default_tenant.duplicate_index = index
+        timings = []
+        for _ in range(queries):
+            question = make_question()
+            started = time.perf_counter()
+            is_duplicate_question(question)
+            timings.append((time.perf_counter() - started) * 1000)
+        default_tenant.duplicate_index = None
+        del index
+
+    timings.sort()
+    print(f"Вопросов в индексе: {total}, построение: {build_time:.1f} с")
+    print(f"Запрос: среднее {sum(timings) / len(timings):.2f} мс, "
+          f"p50 {timings[len(timings) // 2]:.2f} мс, p95 {timings[int(len(timings) * 0.95)]:.2f} мс")
+
+
+# Таблицы (вопросы, голоса), в которых сейчас лежит вопрос: горячие или архивные
+def get_question_tables(cursor, question_id):
+    cursor.execute('SELECT 1 FROM questions_archive WHERE question_id = ?', (question_id,))
+    if cursor.fetchone():
+        return 'questions_archive', 'user_votes_archive'
+    return 'questions', 'user_votes'
+
+
+# Число архивных вопросов берется из журнала архивации, чтобы не считать строки архива
+def get_archived_count(cursor):
+    cursor.execute('SELECT COALESCE(SUM(questions_moved), 0) FROM archive_runs')
+    return cursor.fetchone()[0]
+
+
+# Горячие запросы, время которых сравнивается до и после архивации
+HOT_QUERIES = [
+    ('список вопросов, стр. 1', '''
+        SELECT question_id, question_text, votes, is_answered FROM questions
+        WHERE is_approved = TRUE ORDER BY timestamp DESC LIMIT 5'''),
+    ('топ-10', '''
+        SELECT question_id, question_text, votes FROM questions
+        WHERE is_approved = TRUE ORDER BY votes DESC LIMIT 10'''),
+    ('число одобренных', 'SELECT COUNT(*) FROM questions WHERE is_approved = TRUE'),
+    ('тексты для difflib', 'SELECT question_text FROM questions WHERE is_approved = TRUE'),
+    ('голоса (полный проход)', "SELECT COUNT(*) FROM user_votes WHERE vote_type = 'up'"),
+]
+
+
+def hot_table_report(cursor, repeats=20):
+    sizes = {}
+    for table in ('questions', 'user_votes', 'questions_archive', 'user_votes_archive'):
+        cursor.execute(f'SELECT COUNT(*) FROM {table}')
+        sizes[table] = cursor.fetchone()[0]
+
+    timings = {}
+    for name, sql in HOT_QUERIES:
+        started = time.perf_counter()
+        for _ in range(repeats):
+            cursor.execute(sql).fetchall()
+        timings[name] = (time.perf_counter() - started) / repeats * 1000
+    return sizes, timings
+
+
+def print_archive_report(before, after, questions_moved, votes_moved):
+    print(f"Перенесено в архив: вопросов {questions_moved}, голосов {votes_moved}")
+    print("Размеры таблиц (до -> после):")
+    for table in before[0]:
+        print(f"  {table}: {before[0][table]} -> {after[0][table]}")
+    print("Время горячих запросов, мс (до -> после):")
+    for name in before[1]:
+        print(f"  {name}: {before[1][name]:.2f} -> {after[1][name]:.2f}")
+
+
+# Перенос отвеченных вопросов старше max_age_days и их голосов в архивные таблицы.
+# Чтение вопросов (списки, топ, просмотр, поиск дубликатов) учитывает архив прозрачно
+def archive_old_questions(max_age_days=None, report=False):
+    if max_age_days is None:
+        max_age_days = int(current_tenant().setting('ARCHIVE_AFTER_DAYS', ARCHIVE_AFTER_DAYS))
+    cutoff = datetime.now() - timedelta(days=max_age_days)
+    before = hot_table_report(get_read_connection().cursor()) if report else None
+
+    try:
+        with write_connection() as conn:
+            cursor = conn.cursor()
+            questions_moved, votes_moved = move_to_archive(cursor, cutoff)
+            cursor.execute('DROP TABLE archive_batch')
+    except sqlite3.Error as e:
+        logger.error("Ошибка архивации: %s", e)
+        return 0, 0
+
+    logger.info("Архивация: перенесено вопросов %s, голосов %s", questions_moved, votes_moved)
+    if report:
+        print_archive_report(before, hot_table_report(get_read_connection().cursor()), questions_moved, votes_moved)
+    return questions_moved, votes_moved
+
+
+def move_to_archive(cursor, cutoff):
+    cursor.execute('BEGIN IMMEDIATE')
+    cursor.execute('''
+    CREATE TEMP TABLE archive_batch AS
+    SELECT question_id FROM questions
+    WHERE is_approved = TRUE AND is_answered = TRUE AND timestamp < ?
+    ''', (cutoff,))
+
+    cursor.execute('''
+    INSERT INTO questions_archive (question_id, user_id, question_text, is_approved, is_answered, timestamp, votes)
+    SELECT question_id, user_id, question_text, is_approved, is_answered, timestamp, votes
+    FROM questions WHERE question_id IN (SELECT question_id FROM archive_batch)
+    ''')
+    questions_moved = cursor.rowcount
+
+    cursor.execute('''
+    INSERT INTO user_votes_archive (user_id, question_id, vote_type)
+    SELECT user_id, question_id, vote_type
+    FROM user_votes WHERE question_id IN (SELECT question_id FROM archive_batch)
+    ''')
+    votes_moved = cursor.rowcount
+
+    cursor.execute('DELETE FROM user_votes WHERE question_id IN (SELECT question_id FROM archive_batch)')
+    cursor.execute('DELETE FROM questions WHERE question_id IN (SELECT question_id FROM archive_batch)')
+    cursor.execute('''
+    INSERT INTO archive_runs (run_at, cutoff, questions_moved, votes_moved)
+    VALUES (?, ?, ?, ?)
+    ''', (datetime.now(), cutoff, questions_moved, votes_moved))
+    return questions_moved, votes_moved
+
+
+def run_archive_scheduler():
+    while True:
+        time.sleep(ARCHIVE_INTERVAL_HOURS * 3600)
+        for tenant in tenants:
+            with use_tenant(tenant):
+                archive_old_questions()
+
+
 # Получение текущего голоса пользователя
 def get_user_vote(user_id, question_id):
-    conn = sqlite3.connect('elders_council.db', check_same_thread=False)
-    cursor = conn.cursor()
-    cursor.execute('SELECT vote_type FROM user_votes WHERE user_id = ? AND question_id = ?', (user_id, question_id))
+    cursor = get_read_connection(max_staleness=0).cursor()
+    cursor.execute('''
+    SELECT vote_type FROM user_votes WHERE user_id = ? AND question_id = ?
+    UNION ALL
+    SELECT vote_type FROM user_votes_archive WHERE user_id = ? AND question_id = ?
+    ''', (user_id, question_id, user_id, question_id))
     result = cursor.fetchone()
-    conn.close()
     return result[0] if result else None
 
 
+# Нижняя граница доверительного интервала Уилсона для доли голосов «за» (z = 1.96)
+def wilson_score(upvotes, downvotes, z=1.96):
+    total = upvotes + downvotes
+    if total <= 0:
+        return 0.0
+    share = upvotes / total
+    return ((share + z * z / (2 * total) - z * math.sqrt((share * (1 - share) + z * z / (4 * total)) / total))
+            / (1 + z * z / total))
+
+
+# Движок трендов. По каждому вопросу в памяти: голоса «за», «против» и «горячесть» —
+# сумма изменений голосов с весом 2^((t - epoch) / half_life). Множитель к текущему моменту
+# у всех вопросов общий, поэтому порядок не меняется со временем и пересчитывать старые
+# вопросы не нужно: каждое событие обновляет один вопрос и кладет новую запись в кучу.
+# Устаревшие записи кучи отбрасываются при чтении топа
+class TrendingEngine:
+    # Когда вес свежих событий дорастает до 2^REBASE_AFTER, epoch переносится вперед
+    REBASE_AFTER = 256
+
+    def __init__(self, half_life_hours):
+        self.half_life = half_life_hours * 3600
+        self.lock = threading.Lock()
+        self.epoch = time.time()
+        self.scores = {}
+        self.heap = []
+        self.ready = False
+        self.loaded_through = 0
+        self.pending = []
+
+    def _apply(self, question_id, delta_up, delta_down, created_at):
+        if (created_at - self.epoch) / self.half_life > self.REBASE_AFTER:
+            self._rebase(created_at)
+        aggregate = self.scores.setdefault(question_id, [0, 0, 0.0])
+        aggregate[0] += delta_up
+        aggregate[1] += delta_down
+        aggregate[2] += (delta_up - delta_down) * 2.0 ** ((created_at - self.epoch) / self.half_life)
+        heapq.heappush(self.heap, (-aggregate[2], question_id))
+        if len(self.heap) > 2 * len(self.scores) + 1024:
+            self._rebuild_heap()
+
+    def _rebuild_heap(self):
+        self.heap = [(-hot, question_id) for question_id, (_, _, hot) in self.scores.items()]
+        heapq.heapify(self.heap)
+
+    def _rebase(self, epoch):
+        factor = 2.0 ** ((self.epoch - epoch) / self.half_life)
+        for aggregate in self.scores.values():
+            aggregate[2] *= factor
+        self.epoch = epoch
+        self._rebuild_heap()
+
+    # Начальное состояние: агрегаты последнего офлайн-пересчета (hot относительно epoch)
+    # и события журнала после него
+    def load(self, snapshot, epoch, events):
+        with self.lock:
+            self.epoch = epoch
+            self.scores = {question_id: [up, down, hot] for question_id, up, down, hot in snapshot}
+            self._rebuild_heap()
+            for event_id, question_id, delta_up, delta_down, created_at in events:
+                self._apply(question_id, delta_up, delta_down, created_at)
+                self.loaded_through = max(self.loaded_through, event_id)
+            # События, записанные во время загрузки, но не попавшие в прочитанный журнал
+            for event_id, question_id, delta_up, delta_down, created_at in self.pending:
+                if event_id > self.loaded_through:
+                    self._apply(question_id, delta_up, delta_down, created_at)
+            self.pending = []
+            self.ready = True
+
+    def record(self, event_id, question_id, delta_up, delta_down, created_at):
+        with self.lock:
+            if not self.ready:
+                self.pending.append((event_id, question_id, delta_up, delta_down, created_at))
+            elif event_id > self.loaded_through:
+                self._apply(question_id, delta_up, delta_down, created_at)
+
+    # Топ вопросов с положительной горячестью: [(question_id, за, против, горячесть на текущий момент)]
+    def top(self, limit=10, now=None):
+        now = now or time.time()
+        result = []
+        with self.lock:
+            kept = []
+            while self.heap and len(result) < limit:
+                entry = heapq.heappop(self.heap)
+                hot, question_id = -entry[0], entry[1]
+                aggregate = self.scores.get(question_id)
+                if aggregate is None or aggregate[2] != hot or any(question_id == row[0] for row in result):
+                    continue
+                kept.append(entry)
+                if hot <= 0:
+                    break
+                result.append((question_id, aggregate[0], aggregate[1],
+                               hot * 2.0 ** ((self.epoch - now) / self.half_life)))
+            for entry in kept:
+                heapq.heappush(self.heap, entry)
+        return result
+
+    def get(self, question_id):
+        with self.lock:
+            aggregate = self.scores.get(question_id)
+            return tuple(aggregate) if aggregate else (0, 0, 0.0)
+
+
+def get_half_life_hours():
+    return float(current_tenant().setting('TRENDING_HALF_LIFE_HOURS', TRENDING_HALF_LIFE_HOURS))
+
+
+# Прогрев движка трендов арендатора. Движок подключается до чтения журнала:
+# голоса, поданные во время загрузки, копятся в pending и не теряются
+def init_trending():
+    tenant = current_tenant()
+    half_life_hours = get_half_life_hours()
+    engine = TrendingEngine(half_life_hours)
+    tenant.trending = engine
+
+    cursor = get_read_connection(max_staleness=0).cursor()
+    cursor.execute('SELECT epoch, half_life_hours, last_event_id FROM score_runs ORDER BY run_id DESC LIMIT 1')
+    run = cursor.fetchone()
+    snapshot, epoch, after = [], time.time(), 0
+    if run and run[1] == half_life_hours:
+        epoch, after = run[0], run[2]
+        cursor.execute('SELECT question_id, upvotes, downvotes, hot FROM question_scores')
+        snapshot = cursor.fetchall()
+
+    cursor.execute('''
+    SELECT event_id, question_id, delta_up, delta_down, created_at FROM vote_events
+    WHERE event_id > ? ORDER BY event_id
+    ''', (after,))
+    events = cursor.fetchall()
+    engine.load(snapshot, epoch, events)
+    logger.info("Движок трендов готов: вопросов %s, событий после пересчета %s", len(engine.scores), len(events))
+
+
+# Векторизованный подсчет по всему журналу голосов: то же, что копит TrendingEngine, но одним проходом NumPy.
+# Возвращает идентификаторы вопросов и массивы «за», «против», оценки Уилсона и горячести относительно epoch
+def score_vote_log(question_ids, deltas_up, deltas_down, created_at, epoch, half_life_hours, z=1.96):
+    questions, positions = np.unique(question_ids, return_inverse=True)
+    upvotes = np.bincount(positions, weights=deltas_up, minlength=len(questions))
+    downvotes = np.bincount(positions, weights=deltas_down, minlength=len(questions))
+    weights = np.exp2((created_at - epoch) / (half_life_hours * 3600))
+    hot = np.bincount(positions, weights=(deltas_up - deltas_down) * weights, minlength=len(questions))
+
+    total = upvotes + downvotes
+    with np.errstate(divide='ignore', invalid='ignore'):
+        share = np.where(total > 0, upvotes / total, 0.0)
+        wilson = ((share + z * z / (2 * total) - z * np.sqrt((share * (1 - share) + z * z / (4 * total)) / total))
+                  / (1 + z * z / total))
+    wilson = np.where(total > 0, wilson, 0.0)
+    return questions.astype(np.int64), upvotes.astype(np.int64), downvotes.astype(np.int64), wilson, hot
+
+
+# Офлайн-пересчет агрегатов по всему журналу голосов (--recompute-scores). Результат сохраняется
+# в question_scores, и при следующем старте движок трендов дочитывает только новые события
+def recompute_scores(report=False):
+    if load_numpy() is None:
+        print("Для пересчета нужен NumPy")
+        return None
+
+    started = time.perf_counter()
+    cursor = get_read_connection(max_staleness=0).cursor()
+    cursor.execute('SELECT event_id, question_id, delta_up, delta_down, created_at FROM vote_events ORDER BY event_id')
+    log = np.array(cursor.fetchall(), dtype=np.float64).reshape(-1, 5)
+    loaded = time.perf_counter()
+
+    epoch = time.time()
+    half_life_hours = get_half_life_hours()
+    questions, upvotes, downvotes, wilson, hot = score_vote_log(
+        log[:, 1].astype(np.int64), log[:, 2], log[:, 3], log[:, 4], epoch, half_life_hours)
+    scored = time.perf_counter()
+    last_event_id = int(log[-1, 0]) if len(log) else 0
+
+    with write_connection() as conn:
+        conn.execute('DELETE FROM question_scores')
+        conn.executemany('INSERT INTO question_scores (question_id, upvotes, downvotes, wilson, hot) VALUES (?, ?, ?, ?, ?)',
+                         zip(questions.tolist(), upvotes.tolist(), downvotes.tolist(), wilson.tolist(), hot.tolist()))
+        conn.execute('''
+        INSERT INTO score_runs (run_at, epoch, half_life_hours, last_event_id, events, questions)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ''', (datetime.now(), epoch, half_life_hours, last_event_id, len(log), len(questions)))
+    saved = time.perf_counter()
+
+    if report:
+        print(f"Событий в журнале: {len(log)}, вопросов: {len(questions)}")
+        print(f"  чтение журнала: {(loaded - started) * 1000:.0f} мс, "
+              f"подсчет NumPy: {(scored - loaded) * 1000:.1f} мс, "
+              f"запись question_scores: {(saved - scored) * 1000:.0f} мс")
+        print("Трендовые:")
+        for position in np.argsort(-hot)[:10]:
+            if hot[position] <= 0:
+                break
+            print(f"  #{questions[position]}: 🔥 {hot[position]:.2f}, 👍 {upvotes[position]}, "
+                  f"👎 {downvotes[position]}, Уилсон {wilson[position]:.3f}")
+    return len(log), len(questions)
+
+
+# Сводки уведомлений. Пользователь с включенной сводкой получает не сообщение на каждое событие,
+# а одно сообщение за интервал: события копятся в notification_events и отправляются планировщиком
+DIGEST_INTERVALS = {0: "сразу", 60: "раз в час", 1440: "раз в день"}
+DIGEST_SECTIONS = [
+    ('answer', "💬 Новые ответы"),
+    ('approved', "✅ Одобренные вопросы"),
+    ('rejected', "❌ Отклоненные вопросы"),
+    ('moderation', "❓ Вопросы на модерацию"),
+]
+DIGEST_MAX_MODERATION_BUTTONS = 40
+DIGEST_MAX_LENGTH = 4000
+notification_stats = Counter()
+# В режиме dry run уведомления только считаются (для замеров), в Telegram ничего не уходит
+notifications_dry_run = False
+
+
+def send_notification(chat_id, text, reply_markup=None):
+    notification_stats['sent'] += 1
+    if notifications_dry_run:
+        return
+    bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup)
+
+
+def get_digest_intervals(cursor, user_ids):
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {}
+    placeholders = ','.join('?' * len(user_ids))
+    cursor.execute(f'''
+    SELECT user_id, digest_interval FROM notification_settings
+    WHERE digest_interval > 0 AND user_id IN ({placeholders})
+    ''', user_ids)
+    return dict(cursor.fetchall())
+
+
+# Уведомление пользователя: сразу или через сводку. Вызывается после коммита основной транзакции
+def notify_user(user_id, kind, text, digest_line, reply_markup=None, question_id=None):
+    if get_digest_intervals(get_read_connection().cursor(), [user_id]):
+        with write_connection() as conn:
+            conn.execute('''
+            INSERT INTO notification_events (user_id, kind, question_id, text, created_at)
+            VALUES (?, ?, ?, ?, ?)
+            ''', (user_id, kind, question_id, digest_line, datetime.now()))
+        notification_stats['queued'] += 1
+        return
+
+    try:
+        send_notification(user_id, text, reply_markup)
+    except Exception as e:
+        logger.error("Не удалось отправить уведомление пользователю %s: %s", user_id, e)
+
+
+# Сводка из первых событий, которые помещаются в одно сообщение (по длине и числу кнопок).
+# Возвращает текст, клавиатуру и число вошедших событий — остальные уходят следующим сообщением
+def build_digest(cursor, events):
+    # Вопросы, которые уже обработал другой модератор, в сводку не попадают
+    moderation_ids = [question_id for _, kind, question_id, _ in events if kind == 'moderation']
+    pending = set()
+    if moderation_ids:
+        placeholders = ','.join('?' * len(moderation_ids))
+        cursor.execute(f'SELECT question_id FROM moderation_queue WHERE question_id IN ({placeholders})',
+                       moderation_ids)
+        pending = {row[0] for row in cursor.fetchall()}
+
+    header = "📬 Сводка уведомлений"
+    # Запас под заголовки разделов со счетчиками
+    full_budget = DIGEST_MAX_LENGTH - len(header) - sum(len(title) + 12 for _, title in DIGEST_SECTIONS)
+    budget = full_budget
+    taken = 0
+    buttons = 0
+    for _, kind, question_id, text in events:
+        if kind == 'moderation' and question_id not in pending:
+            taken += 1
+            continue
+        line_length = len(text) + 3
+        needs_button = kind == 'moderation'
+        # Первое событие берется всегда, даже если оно длиннее сообщения
+        if budget < full_budget and (line_length > budget or
+                                     (needs_button and buttons >= DIGEST_MAX_MODERATION_BUTTONS)):
+            break
+        budget -= line_length
+        buttons += needs_button
+        taken += 1
+    rendered = events[:taken]
+
+    lines = [header]
+    keyboard = types.InlineKeyboardMarkup()
+    for kind, title in DIGEST_SECTIONS:
+        items = [(question_id, text) for _, event_kind, question_id, text in rendered
+                 if event_kind == kind and (kind != 'moderation' or question_id in pending)]
+        if not items:
+            continue
+        lines.append(f"\n{title} ({len(items)}):")
+        for question_id, text in items:
+            lines.append(f"• {text}")
+            if kind == 'moderation':
+                keyboard.row(
+                    types.InlineKeyboardButton(f"Одобрить #{question_id}", callback_data=f'approve_{question_id}'),
+                    types.InlineKeyboardButton(f"Отклонить #{question_id}", callback_data=f'reject_{question_id}')
+                )
+
+    if len(lines) == 1:
+        return None, None, taken
+    text = '\n'.join(lines)
+    if len(text) > DIGEST_MAX_LENGTH:
+        # Единственное событие длиннее сообщения
+        text = text[:DIGEST_MAX_LENGTH - 1] + '…'
+    return text, keyboard if buttons else None, taken
+
+
+# Отправка сводок всем, у кого подошел срок. user_id ограничивает отправку одним пользователем.
+# Если события не помещаются в одно сообщение, сводка уходит несколькими; курсор last_event_id
+# сдвигается только за отправленные события. При ошибке отправки события остаются,
+# а следующая попытка откладывается на интервал сводки
+def flush_digests(now=None, user_id=None):
+    now = now or datetime.now()
+    cursor = get_read_connection().cursor()
+    sent = 0
+
+    try:
+        if user_id is None:
+            cursor.execute('''
+            SELECT user_id, digest_interval, last_event_id FROM notification_settings
+            WHERE digest_interval > 0 AND (next_digest_at IS NULL OR next_digest_at <= ?)
+            ''', (now,))
+        else:
+            cursor.execute('''
+            SELECT user_id, digest_interval, last_event_id FROM notification_settings WHERE user_id = ?
+            ''', (user_id,))
+
+        for recipient_id, interval, last_event_id in cursor.fetchall():
+            cursor.execute('''
+            SELECT event_id, kind, question_id, text FROM notification_events
+            WHERE user_id = ? AND event_id > ?
+            ORDER BY event_id
+            ''', (recipient_id, last_event_id))
+            events = cursor.fetchall()
+            if not events:
+                continue
+
+            next_digest_at = now + timedelta(minutes=interval)
+            while events:
+                text, keyboard, taken = build_digest(cursor, events)
+                if text:
+                    try:
+                        send_notification(recipient_id, text, keyboard)
+                        sent += 1
+                    except Exception as e:
+                        logger.error("Не удалось отправить сводку пользователю %s: %s", recipient_id, e)
+                        with write_connection() as conn:
+                            conn.execute('UPDATE notification_settings SET next_digest_at = ? WHERE user_id = ?',
+                                         (next_digest_at, recipient_id))
+                        break
+
+                last_event_id = events[taken - 1][0]
+                events = events[taken:]
+                with write_connection() as conn:
+                    conn.execute('''
+                    UPDATE notification_settings SET last_event_id = ?, next_digest_at = ? WHERE user_id = ?
+                    ''', (last_event_id, next_digest_at, recipient_id))
+                    conn.execute('DELETE FROM notification_events WHERE user_id = ? AND event_id <= ?',
+                                 (recipient_id, last_event_id))
+    except sqlite3.Error as e:
+        logger.error("Ошибка отправки сводок: %s", e)
+    return sent
+
+
+def run_digest_scheduler():
+    while True:
+        time.sleep(DIGEST_TICK_SECONDS)
+        for tenant in tenants:
+            with use_tenant(tenant):
+                flush_digests()
+
+
+# Служебные счетчики арендатора с момента запуска: правки меню, антифлуд, обновления снимков БД
+def service_counters(tenant):
+    throttle = tenant.throttle_middleware
+    if throttle is not None:
+        with throttle.lock:
+            throttle_stats = dict(throttle.stats)
+    else:
+        throttle_stats = {}
+    return {
+        'render': dict(tenant.render_stats),
+        'throttle': throttle_stats,
+        'snapshot': dict(tenant.snapshot_stats),
+    }
+
+
+def format_counters(counters):
+    return ', '.join(f"{name} {value}" for name, value in sorted(counters.items())) or '—'
+
+
+def run_stats_logger():
+    while True:
+        time.sleep(STATS_LOG_INTERVAL_MINUTES * 60)
+        for tenant in tenants:
+            with use_tenant(tenant):
+                service = service_counters(tenant)
+                logger.info("Служебные счетчики: меню %s; антифлуд %s; снимки БД %s",
+                            format_counters(service['render']), format_counters(service['throttle']),
+                            format_counters(service['snapshot']))
+
+
+# Замер исходящих сообщений в час: мгновенные уведомления против часовой сводки.
+# Работает во временной БД в режиме dry run, в Telegram ничего не отправляется
+def benchmark_digests(moderator_counts=(10, 100, 1000), questions_per_hour=60, hours=3):
+    global notifications_dry_run
+    notifications_dry_run = True
+    workdir = os.getcwd()
+
+    print(f"Вопросов в час: {questions_per_hour}, модель: {hours} ч")
+    for moderators in moderator_counts:
+        results = {}
+        for interval in (0, 60):
+            with tempfile.TemporaryDirectory() as tmp:
+                os.chdir(tmp)
+                close_connections()
+                try:
+                    init_db()
+                    conn = sqlite3.connect('elders_council.db')
+                    conn.executemany("INSERT INTO users (user_id, role) VALUES (?, 'moder')",
+                                     [(user_id,) for user_id in range(1, moderators + 1)])
+                    conn.executemany('INSERT INTO notification_settings (user_id, digest_interval) VALUES (?, ?)',
+                                     [(user_id, interval) for user_id in range(1, moderators + 1)])
+                    conn.commit()
+
+                    notification_stats.clear()
+                    started = datetime.now()
+                    asked = 0
+                    for minute in range(hours * 60):
+                        now = started + timedelta(minutes=minute)
+                        while asked * 60 / questions_per_hour <= minute:
+                            asked += 1
+                            cursor = conn.execute('INSERT INTO questions (user_id, question_text, timestamp) '
+                                                  'VALUES (0, ?, ?)', (f'Вопрос {minute}', now))
+                            conn.execute('INSERT INTO moderation_queue (question_id) VALUES (?)', (cursor.lastrowid,))
+                            conn.commit()
+                            notify_moderators(cursor.lastrowid, f'Вопрос {minute}')
+                        flush_digests(now)
+                    conn.close()
+                    results[interval] = notification_stats['sent'] / hours
+                finally:
+                    close_connections()
+                    os.chdir(workdir)
+
+        saved = 100 * (1 - results[60] / results[0]) if results[0] else 0
+        print(f"  модераторов {moderators}: сразу {results[0]:.0f} сообщ./ч, "
+              f"сводка раз в час {results[60]:.0f} сообщ./ч (-{saved:.1f}%)")
+
+    notifications_dry_run = False
+
+
+@bot.message_handler(commands=['digest'])
+def digest_settings(message):
+    cursor = get_read_connection(max_staleness=0).cursor()
+    interval = get_digest_intervals(cursor, [message.from_user.id]).get(message.from_user.id, 0)
+
+    keyboard = types.InlineKeyboardMarkup()
+    for minutes, title in DIGEST_INTERVALS.items():
+        mark = "✅ " if minutes == interval else ""
+        keyboard.add(types.InlineKeyboardButton(f"{mark}{title.capitalize()}", callback_data=f'digest_{minutes}'))
+
+    bot.send_message(
+        chat_id=message.chat.id,
+        text="Как присылать уведомления? В режиме сводки события собираются в одно сообщение.",
+        reply_markup=keyboard
+    )
+
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith('digest_'))
+def set_digest_interval(call):
+    interval = int(call.data.split('_')[1])
+    if interval not in DIGEST_INTERVALS:
+        bot.answer_callback_query(call.id)
+        return
+    user_id = call.from_user.id
+
+    with write_connection() as conn:
+        conn.execute('''
+        INSERT INTO notification_settings (user_id, digest_interval) VALUES (?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET digest_interval = excluded.digest_interval
+        ''', (user_id, interval))
+
+    # При переходе на мгновенные уведомления накопленное отправляется сразу
+    if interval == 0:
+        flush_digests(user_id=user_id)
+
+    bot.answer_callback_query(call.id, f"Уведомления: {DIGEST_INTERVALS[interval]}")
+    edit_menu(
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        text=f"Уведомления приходят {DIGEST_INTERVALS[interval]}. Изменить: /digest"
+    )
+
+
 # Уведомление автора вопроса о новом ответе
 def notify_question_author(question_id, answer_text, answerer_name):
-    conn = sqlite3.connect('elders_council.db', check_same_thread=False)
-    cursor = conn.cursor()
+    cursor = get_read_connection(max_staleness=0).cursor()
 
     # Получаем автора вопроса
-    cursor.execute('SELECT user_id, question_text FROM questions WHERE question_id = ?', (question_id,))
+    cursor.execute('''
+    SELECT user_id, question_text FROM questions WHERE question_id = ?
+    UNION ALL
+    SELECT user_id, question_text FROM questions_archive WHERE question_id = ?
+    ''', (question_id, question_id))
     result = cursor.fetchone()
 
     if result:
@@ -153,38 +1707,222 @@ def notify_question_author(question_id, answer_text, answerer_name):
 💬 Ответ от {answerer_name}: {answer_text}
         """
 
-        try:
-            bot.send_message(author_id, notification_text)
-        except Exception as e:
-            logger.error(f"Не удалось отправить уведомление автору вопроса: {e}")
+        notify_user(author_id, 'answer', notification_text,
+                    f"«{question_text}» — {answerer_name}: {answer_text}", question_id=question_id)
 
-    conn.close()
+
+# Отпечатки последней отрисовки сообщений: (арендатор, chat_id, message_id) -> (хеш текста, хеш клавиатуры).
+# Позволяют не вызывать edit_message_text, если текст и кнопки не изменились
+RENDER_CACHE_LIMIT = 20000
+render_fingerprints = OrderedDict()
+render_lock = threading.Lock()
+
+
+def render_fingerprint(text, reply_markup):
+    text_hash = hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest()
+    markup_json = reply_markup.to_json() if reply_markup else ''
+    markup_hash = hashlib.blake2b(markup_json.encode('utf-8'), digest_size=8).digest()
+    return text_hash, markup_hash
+
+
+def remember_render(chat_id, message_id, text, reply_markup=None):
+    key = (current_tenant().name, chat_id, message_id)
+    with render_lock:
+        render_fingerprints[key] = render_fingerprint(text, reply_markup)
+        render_fingerprints.move_to_end(key)
+        if len(render_fingerprints) > RENDER_CACHE_LIMIT:
+            render_fingerprints.popitem(last=False)
+
+
+def forget_render(chat_id, message_id):
+    with render_lock:
+        render_fingerprints.pop((current_tenant().name, chat_id, message_id), None)
+
+
+# Редактирование меню с пропуском пустых правок: если текст и кнопки не изменились,
+# запрос не отправляется; если изменились только кнопки — меняется только клавиатура
+def edit_menu(chat_id, message_id, text, reply_markup=None, **kwargs):
+    fingerprint = render_fingerprint(text, reply_markup)
+    with render_lock:
+        previous = render_fingerprints.get((current_tenant().name, chat_id, message_id))
+
+    try:
+        if previous == fingerprint:
+            current_tenant().render_stats['skipped'] += 1
+            return
+        if previous and previous[0] == fingerprint[0]:
+            current_tenant().render_stats['markup_only'] += 1
+            bot.edit_message_reply_markup(chat_id=chat_id, message_id=message_id, reply_markup=reply_markup)
+        else:
+            current_tenant().render_stats['edited'] += 1
+            bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text,
+                                  reply_markup=reply_markup, **kwargs)
+    except ApiTelegramException as e:
+        if 'message is not modified' not in e.description:
+            forget_render(chat_id, message_id)
+            raise
+        current_tenant().render_stats['not_modified'] += 1
+    remember_render(chat_id, message_id, text, reply_markup)
 
 
 # Удаление предыдущего меню
 def delete_previous_menu(chat_id, message_id):
     try:
         if message_id:
+            forget_render(chat_id, message_id)
             bot.delete_message(chat_id, message_id)
     except Exception as e:
-        logger.debug(f"Не удалось удалить предыдущее меню: {e}")
+        logger.debug("Не удалось удалить предыдущее меню: %s", e)
+
+
+# Контекст логирования для каждого сообщения и callback-запроса. Стоит перед антифлудом,
+# чтобы отброшенные нажатия тоже логировались с идентификатором запроса
+class LogContextMiddleware(BaseMiddleware):
+    def __init__(self):
+        super().__init__()
+        self.update_types = ['message', 'callback_query']
+
+    def pre_process(self, update, data):
+        message = update.message if isinstance(update, types.CallbackQuery) else update
+        log_local.context = {
+            'request_id': os.urandom(6).hex(),
+            'chat_id': message.chat.id if message else None,
+            'user_id': update.from_user.id,
+        }
+
+    def post_process(self, update, data, exception):
+        log_local.context = {}
+
+
+log_context_middleware = LogContextMiddleware()
+bot.setup_middleware(log_context_middleware)
+
+
+# Лимиты нажатий кнопок: действие -> (токенов в секунду, размер корзины).
+# Кроме лимита на действие, у каждого пользователя есть общий лимит 'user'
+THROTTLE_LIMITS = {
+    'vote': (1.0, 4),
+    'view_question': (2.0, 6),
+    'view_questions_page': (2.0, 6),
+    'user': (5.0, 15),
+    'default': (2.0, 6),
+}
+# Повторная отрисовка того же экрана в том же сообщении в пределах окна (секунды) отбрасывается
+RENDER_DEBOUNCE = 1.5
+DEBOUNCED_ACTIONS = {'view_question', 'view_questions', 'view_questions_page', 'top_questions', 'trending_questions',
+                     'show_rules', 'back_to_main'}
+
+
+# Имя действия для лимитов: callback_data без идентификатора в конце (vote_up_5 -> vote)
+def callback_action(data):
+    if data.startswith('vote_'):
+        return 'vote'
+    return re.sub(r'_-?\d+$', '', data)
+
+
+# Антифлуд перед роутером callback-запросов: корзины токенов на пользователя и действие,
+# отбрасывание повторных доставок одного callback, склейка нажатий на кнопку,
+# которая еще обрабатывается, и подавление одинаковых перерисовок
+class ThrottleMiddleware(BaseMiddleware):
+    SEEN_CALLBACKS_LIMIT = 10000
+    IDLE_TTL = 600
+    # Корзины и отпечатки перерисовок чистятся по времени, а не по размеру: в небольшом совете
+    # корзин мало, а last_renders пополняется каждым новым сообщением
+    CLEANUP_INTERVAL = 60
+
+    def __init__(self):
+        super().__init__()
+        self.update_types = ['callback_query']
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.seen_callbacks = OrderedDict()
+        self.in_flight = set()
+        self.last_renders = {}
+        self.last_cleanup = time.monotonic()
+        self.stats = Counter()
+
+    def _take_token(self, key, limit, now):
+        rate, burst = limit
+        tokens, updated = self.buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        if tokens < 1:
+            self.buckets[key] = (tokens, now)
+            return False
+        self.buckets[key] = (tokens - 1, now)
+        return True
+
+    def _cleanup(self, now):
+        self.last_cleanup = now
+        for key in [key for key, (_, updated) in self.buckets.items() if now - updated > self.IDLE_TTL]:
+            del self.buckets[key]
+        for key in [key for key, (_, rendered) in self.last_renders.items() if now - rendered > RENDER_DEBOUNCE]:
+            del self.last_renders[key]
+
+    def pre_process(self, call, data):
+        now = time.monotonic()
+        user_id = call.from_user.id
+        action = callback_action(call.data)
+        message_key = (call.message.chat.id, call.message.message_id) if call.message else None
+        press_key = (message_key, call.data)
+        reply = None
+
+        with self.lock:
+            if call.id in self.seen_callbacks:
+                # Telegram доставил тот же callback повторно — на него уже ответили
+                self.stats['duplicate'] += 1
+                return CancelUpdate()
+            self.seen_callbacks[call.id] = None
+            if len(self.seen_callbacks) > self.SEEN_CALLBACKS_LIMIT:
+                self.seen_callbacks.popitem(last=False)
+            if now - self.last_cleanup > self.CLEANUP_INTERVAL:
+                self._cleanup(now)
+
+            last_render = self.last_renders.get(message_key)
+            if press_key in self.in_flight:
+                self.stats['coalesced'] += 1
+            elif (action in DEBOUNCED_ACTIONS and last_render and last_render[0] == call.data
+                  and now - last_render[1] < RENDER_DEBOUNCE):
+                self.stats['debounced'] += 1
+            elif not (self._take_token((user_id, action), THROTTLE_LIMITS.get(action, THROTTLE_LIMITS['default']), now)
+                      and self._take_token((user_id, 'user'), THROTTLE_LIMITS['user'], now)):
+                self.stats['throttled'] += 1
+                reply = "⏳ Слишком часто, подождите немного"
+            else:
+                self.stats['passed'] += 1
+                self.in_flight.add(press_key)
+                if action in DEBOUNCED_ACTIONS:
+                    self.last_renders[message_key] = (call.data, now)
+                data['press_key'] = press_key
+                return None
+
+        try:
+            bot.answer_callback_query(call.id, reply)
+        except Exception as e:
+            logger.debug("Не удалось ответить на отброшенный callback: %s", e)
+        return CancelUpdate()
+
+    def post_process(self, call, data, exception):
+        with self.lock:
+            self.in_flight.discard(data.get('press_key'))
+
+
+throttle_middleware = ThrottleMiddleware()
+bot.setup_middleware(throttle_middleware)
+default_tenant.throttle_middleware = throttle_middleware
 
 
 # Обработчики команд
 @bot.message_handler(commands=['start'])
 def start(message):
     user = message.from_user
-    conn = sqlite3.connect('elders_council.db', check_same_thread=False)
-    cursor = conn.cursor()
-
-    cursor.execute('SELECT * FROM users WHERE user_id = ?', (user.id,))
-    if not cursor.fetchone():
-        cursor.execute('''
-        INSERT INTO users (user_id, username, first_name, last_name, role, join_date)
-        VALUES (?, ?, ?, ?, ?, ?)
-        ''', (user.id, user.username, user.first_name, user.last_name, 'user', datetime.now()))
-        conn.commit()
-    conn.close()
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM users WHERE user_id = ?', (user.id,))
+        if not cursor.fetchone():
+            cursor.execute('''
+            INSERT INTO users (user_id, username, first_name, last_name, role, join_date)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ''', (user.id, user.username, user.first_name, user.last_name, 'user', datetime.now()))
 
     if check_agreement(user.id):
         show_main_menu(message)
@@ -229,11 +1967,8 @@ def show_agreement(message):
 def accept_agreement(call):
     user_id = call.from_user.id
 
-    conn = sqlite3.connect('elders_council.db', check_same_thread=False)
-    cursor = conn.cursor()
-    cursor.execute('UPDATE users SET agreement_accepted = TRUE WHERE user_id = ?', (user_id,))
-    conn.commit()
-    conn.close()
+    with write_connection() as conn:
+        conn.execute('UPDATE users SET agreement_accepted = TRUE WHERE user_id = ?', (user_id,))
 
     bot.answer_callback_query(call.id, "Спасибо! Теперь вы можете пользоваться ботом.")
     show_main_menu(call.message, call.message.message_id)
@@ -250,26 +1985,28 @@ def show_main_menu(message, message_id=None):
     keyboard = types.InlineKeyboardMarkup()
     keyboard.add(types.InlineKeyboardButton("Задать вопрос", callback_data='ask_question'))
     keyboard.add(types.InlineKeyboardButton("Топ вопросов", callback_data='top_questions'))
+    keyboard.add(types.InlineKeyboardButton("Трендовые", callback_data='trending_questions'))
     keyboard.add(types.InlineKeyboardButton("Просмотреть вопросы", callback_data='view_questions'))
     keyboard.add(types.InlineKeyboardButton("Правила", callback_data='show_rules'))
 
     if message_id:
         # Редактируем существующее сообщение
         try:
-            bot.edit_message_text(
+            edit_menu(
                 chat_id=message.chat.id,
                 message_id=message_id,
                 text=menu_text,
                 reply_markup=keyboard
             )
         except Exception as e:
-            logger.debug(f"Не удалось отредактировать сообщение, отправляем новое: {e}")
+            logger.debug("Не удалось отредактировать сообщение, отправляем новое: %s", e)
             # Если не удалось отредактировать, отправляем новое сообщение
             sent_msg = bot.send_message(
                 chat_id=message.chat.id,
                 text=menu_text,
                 reply_markup=keyboard
             )
+            remember_render(message.chat.id, sent_msg.message_id, menu_text, keyboard)
             global current_menu_message_id
             current_menu_message_id = sent_msg.message_id
     else:
@@ -283,6 +2020,7 @@ def show_main_menu(message, message_id=None):
             text=menu_text,
             reply_markup=keyboard
         )
+        remember_render(message.chat.id, sent_msg.message_id, menu_text, keyboard)
 
         current_menu_message_id = sent_msg.message_id
 
@@ -332,19 +2070,17 @@ def process_question(message, chat_id):
         return
 
     # Сохраняем вопрос в базу данных (пока не одобрен)
-    conn = sqlite3.connect('elders_council.db', check_same_thread=False)
-    cursor = conn.cursor()
-
-    cursor.execute('''
-    INSERT INTO questions (user_id, question_text, timestamp)
-    VALUES (?, ?, ?)
-    ''', (user_id, question_text, datetime.now()))
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+        INSERT INTO questions (user_id, question_text, timestamp)
+        VALUES (?, ?, ?)
+        ''', (user_id, question_text, datetime.now()))
 
-    question_id = cursor.lastrowid
-    cursor.execute('INSERT INTO moderation_queue (question_id) VALUES (?)', (question_id,))
-
-    conn.commit()
-    conn.close()
+        question_id = cursor.lastrowid
+        cursor.execute('INSERT INTO moderation_queue (question_id) VALUES (?)', (question_id,))
+        bump_daily_stats(cursor, questions_asked=1)
+        bump_counter(cursor, 'moderation_backlog')
 
     # Удаляем сообщение с вопросом пользователя
     try:
@@ -352,7 +2088,7 @@ def process_question(message, chat_id):
         # Также пытаемся удалить сообщение с просьбой ввести вопрос
         bot.delete_message(chat_id, message.message_id - 1)
     except Exception as e:
-        logger.debug(f"Ошибка при удалении сообщений: {e}")
+        logger.debug("Ошибка при удалении сообщений: %s", e)
 
     # Отправляем подтверждение
     bot.send_message(
@@ -368,12 +2104,21 @@ def process_question(message, chat_id):
 
 
 def notify_moderators(question_id: int, question_text: str):
-    conn = sqlite3.connect('elders_council.db', check_same_thread=False)
-    cursor = conn.cursor()
+    cursor = get_read_connection(max_staleness=0).cursor()
 
     cursor.execute('''SELECT user_id FROM users WHERE role = 'moder' ''')
-    moderators = cursor.fetchall()
-    conn.close()
+    moderators = [row[0] for row in cursor.fetchall()]
+    digest_moderators = get_digest_intervals(cursor, moderators)
+
+    # Модераторам со сводкой событие записывается одной пачкой
+    if digest_moderators:
+        with write_connection() as conn:
+            conn.executemany('''
+            INSERT INTO notification_events (user_id, kind, question_id, text, created_at)
+            VALUES (?, 'moderation', ?, ?, ?)
+            ''', [(user_id, question_id, f"#{question_id}: {question_text}", datetime.now())
+                  for user_id in digest_moderators])
+    notification_stats['queued'] += len(digest_moderators)
 
     keyboard = types.InlineKeyboardMarkup()
     keyboard.add(
@@ -381,16 +2126,74 @@ def notify_moderators(question_id: int, question_text: str):
         types.InlineKeyboardButton("Отклонить", callback_data=f'reject_{question_id}')
     )
 
-    for moderator in moderators:
-        user_id = moderator[0]
+    for user_id in moderators:
+        if user_id in digest_moderators:
+            continue
         try:
-            bot.send_message(
-                chat_id=user_id,
-                text=f"❓ Новый вопрос на модерацию (ID: {question_id}):\n\n{question_text}",
-                reply_markup=keyboard
+            send_notification(
+                user_id,
+                f"❓ Новый вопрос на модерацию (ID: {question_id}):\n\n{question_text}",
+                keyboard
             )
         except Exception as e:
-            logger.error(f"Не удалось отправить уведомление модератору {user_id}: {e}")
+            logger.error("Не удалось отправить уведомление модератору %s: %s", user_id, e)
+
+
+# Обновление сообщения модератора. В сводке с несколькими вопросами убирается только
+# строка кнопок обработанного вопроса, остальные остаются
+def update_moderation_message(call, question_id, text):
+    handled = (f'approve_{question_id}', f'reject_{question_id}')
+    markup = call.message.reply_markup
+    rows = [row for row in markup.keyboard if not any(b.callback_data in handled for b in row)] if markup else []
+
+    if rows:
+        keyboard = types.InlineKeyboardMarkup()
+        for row in rows:
+            keyboard.row(*row)
+        bot.edit_message_reply_markup(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            reply_markup=keyboard
+        )
+    else:
+        bot.edit_message_text(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text=text
+        )
+
+
+# Запись решения модератора. Возвращает (автор, текст вопроса) или None, если вопрос не найден
+def apply_moderation(action, question_id):
+    with write_connection() as conn:
+        cursor = conn.cursor()
+
+        # Получаем информацию о вопросе
+        cursor.execute('SELECT user_id, question_text FROM questions WHERE question_id = ?', (question_id,))
+        result = cursor.fetchone()
+
+        if not result:
+            return None
+
+        if action == 'approve':
+            # Одобряем вопрос
+            cursor.execute('UPDATE questions SET is_approved = TRUE WHERE question_id = ?', (question_id,))
+            cursor.execute('DELETE FROM moderation_queue WHERE question_id = ?', (question_id,))
+            dequeued = cursor.rowcount
+            # Повторное нажатие другим модератором уже не находит вопрос в очереди и не считается
+            if dequeued:
+                bump_daily_stats(cursor, questions_approved=1)
+        else:  # reject
+            # Удаляем вопрос
+            cursor.execute('DELETE FROM questions WHERE question_id = ?', (question_id,))
+            cursor.execute('DELETE FROM moderation_queue WHERE question_id = ?', (question_id,))
+            dequeued = cursor.rowcount
+            cursor.execute('DELETE FROM user_votes WHERE question_id = ?', (question_id,))
+            if dequeued:
+                bump_daily_stats(cursor, questions_rejected=1)
+        bump_counter(cursor, 'moderation_backlog', -dequeued)
+
+        return result
 
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith(('approve_', 'reject_')))
@@ -398,13 +2201,8 @@ def handle_moderation(call):
     action, question_id = call.data.split('_')
     question_id = int(question_id)
 
-    conn = sqlite3.connect('elders_council.db', check_same_thread=False)
-    cursor = conn.cursor()
-
     try:
-        # Получаем информацию о вопросе
-        cursor.execute('SELECT user_id, question_text FROM questions WHERE question_id = ?', (question_id,))
-        result = cursor.fetchone()
+        result = apply_moderation(action, question_id)
 
         if not result:
             bot.answer_callback_query(call.id, "Вопрос не найден")
@@ -413,80 +2211,79 @@ def handle_moderation(call):
         user_id, question_text = result
 
         if action == 'approve':
-            # Одобряем вопрос
-            cursor.execute('UPDATE questions SET is_approved = TRUE WHERE question_id = ?', (question_id,))
-            cursor.execute('DELETE FROM moderation_queue WHERE question_id = ?', (question_id,))
+            add_question_to_index(question_id, question_text)
 
             # Уведомляем пользователя
-            try:
-                bot.send_message(
-                    chat_id=user_id,
-                    text=f"✅ Ваш вопрос одобрен и опубликован:\n\n{question_text}"
-                )
-            except Exception as e:
-                logger.error(f"Не удалось уведомить пользователя: {e}")
+            notify_user(user_id, 'approved', f"✅ Ваш вопрос одобрен и опубликован:\n\n{question_text}",
+                        question_text, question_id=question_id)
 
             # Обновляем сообщение модератора
-            bot.edit_message_text(
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                text=f"✅ Вопрос одобрен:\n\n{question_text}"
-            )
+            update_moderation_message(call, question_id, f"✅ Вопрос одобрен:\n\n{question_text}")
 
         else:  # reject
-            # Удаляем вопрос
-            cursor.execute('DELETE FROM questions WHERE question_id = ?', (question_id,))
-            cursor.execute('DELETE FROM moderation_queue WHERE question_id = ?', (question_id,))
-            cursor.execute('DELETE FROM user_votes WHERE question_id = ?', (question_id,))
+            remove_question_from_index(question_id)
 
             # Уведомляем пользователя
-            try:
-                bot.send_message(
-                    chat_id=user_id,
-                    text=f"❌ Ваш вопрос отклонен модератором:\n\n{question_text}"
-                )
-            except Exception as e:
-                logger.error(f"Не удалось уведомить пользователя: {e}")
+            notify_user(user_id, 'rejected', f"❌ Ваш вопрос отклонен модератором:\n\n{question_text}",
+                        question_text, question_id=question_id)
 
             # Обновляем сообщение модератора
-            bot.edit_message_text(
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                text=f"❌ Вопрос отклонен:\n\n{question_text}"
-            )
+            update_moderation_message(call, question_id, f"❌ Вопрос отклонен:\n\n{question_text}")
 
-        conn.commit()
         bot.answer_callback_query(call.id, "Действие выполнено")
 
     except Exception as e:
-        logger.error(f"Ошибка модерации: {e}")
+        logger.error("Ошибка модерации: %s", e, exc_info=True)
         bot.answer_callback_query(call.id, "Ошибка при выполнении действия")
-        conn.rollback()
-    finally:
-        conn.close()
+
+
+def fetch_top_questions(cursor):
+    # Обе таблицы читаются по индексу votes и сливаются без полной сортировки
+    cursor.execute('''
+    SELECT question_id, question_text, votes 
+    FROM questions 
+    WHERE is_approved = TRUE
+    UNION ALL
+    SELECT question_id, question_text, votes
+    FROM questions_archive
+    ORDER BY votes DESC 
+    LIMIT 10
+    ''')
+    return cursor.fetchall()
+
+
+def count_listed_questions(cursor):
+    cursor.execute('SELECT COUNT(*) FROM questions WHERE is_approved = TRUE')
+    return cursor.fetchone()[0] + get_archived_count(cursor)
+
+
+def fetch_questions_page(cursor, limit, offset):
+    cursor.execute('''
+    SELECT question_id, question_text, votes, is_answered, timestamp
+    FROM questions 
+    WHERE is_approved = TRUE
+    UNION ALL
+    SELECT question_id, question_text, votes, is_answered, timestamp
+    FROM questions_archive
+    ORDER BY timestamp DESC
+    LIMIT ? OFFSET ?
+    ''', (limit, offset))
+    return cursor.fetchall()
 
 
 @bot.callback_query_handler(func=lambda call: call.data == 'top_questions')
 def show_top_questions(call):
     bot.answer_callback_query(call.id)
 
-    conn = sqlite3.connect('elders_council.db', check_same_thread=False)
-    cursor = conn.cursor()
+    # Топ может отставать от записей на полминуты
+    cursor = get_read_connection(max_staleness=30).cursor()
 
     try:
-        cursor.execute('''
-        SELECT question_id, question_text, votes 
-        FROM questions 
-        WHERE is_approved = TRUE
-        ORDER BY votes DESC 
-        LIMIT 10
-        ''')
-
-        top_questions = cursor.fetchall()
+        top_questions = fetch_top_questions(cursor)
 
         if not top_questions:
             text = "⭐ Пока нет вопросов с высоким рейтингом."
-            bot.edit_message_text(
+            edit_menu(
                 chat_id=call.message.chat.id,
                 message_id=call.message.message_id,
                 text=text
@@ -504,7 +2301,7 @@ def show_top_questions(call):
 
             keyboard.add(types.InlineKeyboardButton("🔙 Назад", callback_data='back_to_main'))
 
-            bot.edit_message_text(
+            edit_menu(
                 chat_id=call.message.chat.id,
                 message_id=call.message.message_id,
                 text="🏆 Топ-10 вопросов. Выберите вопрос для просмотра:",
@@ -512,10 +2309,52 @@ def show_top_questions(call):
             )
 
     except sqlite3.Error as e:
-        logger.error(f"Database error in top questions: {e}")
+        logger.error("Database error in top questions: %s", e, exc_info=True)
         bot.answer_callback_query(call.id, "⚠ Ошибка при получении вопросов.")
-    finally:
-        conn.close()
+
+
+# Трендовые вопросы из движка трендов: голоса за последние сутки-двое весят больше старых
+@bot.callback_query_handler(func=lambda call: call.data == 'trending_questions')
+def show_trending_questions(call):
+    bot.answer_callback_query(call.id)
+    engine = current_tenant().trending
+    trending = engine.top(10) if engine is not None and engine.ready else []
+    if not trending:
+        edit_menu(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text="🔥 Сейчас нет вопросов, за которые активно голосуют."
+        )
+        return
+
+    cursor = get_read_connection(max_staleness=30).cursor()
+    ids = [question_id for question_id, _, _, _ in trending]
+    placeholders = ','.join('?' * len(ids))
+    cursor.execute(f'''
+    SELECT question_id, question_text FROM questions WHERE question_id IN ({placeholders}) AND is_approved = TRUE
+    UNION ALL
+    SELECT question_id, question_text FROM questions_archive WHERE question_id IN ({placeholders})
+    ''', ids + ids)
+    texts = dict(cursor.fetchall())
+
+    keyboard = types.InlineKeyboardMarkup()
+    for question_id, upvotes, downvotes, hot in trending:
+        if question_id not in texts:
+            continue
+        q_text = texts[question_id]
+        button_text = f"{q_text[:30]}..." if len(q_text) > 30 else q_text
+        keyboard.add(types.InlineKeyboardButton(
+            f"{button_text} (🔥 {hot:.1f})",
+            callback_data=f'view_question_{question_id}'
+        ))
+    keyboard.add(types.InlineKeyboardButton("🔙 Назад", callback_data='back_to_main'))
+
+    edit_menu(
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        text="🔥 Трендовые вопросы. Выберите вопрос для просмотра:",
+        reply_markup=keyboard
+    )
 
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith('view_question_'))
@@ -523,8 +2362,8 @@ def view_question(call):
     question_id = int(call.data.split('_')[2])
     user_id = call.from_user.id
 
-    conn = sqlite3.connect('elders_council.db', check_same_thread=False)
-    cursor = conn.cursor()
+    # Сразу после голосования вопрос перерисовывается, поэтому нужны свежие данные
+    cursor = get_read_connection(max_staleness=0).cursor()
 
     try:
         # Получаем информацию о вопросе
@@ -532,7 +2371,11 @@ def view_question(call):
         SELECT question_text, votes, is_answered 
         FROM questions 
         WHERE question_id = ? AND is_approved = TRUE
-        ''', (question_id,))
+        UNION ALL
+        SELECT question_text, votes, is_answered
+        FROM questions_archive
+        WHERE question_id = ?
+        ''', (question_id, question_id))
         question = cursor.fetchone()
 
         if not question:
@@ -593,7 +2436,7 @@ def view_question(call):
 
         keyboard.add(types.InlineKeyboardButton("🔙 Назад к вопросам", callback_data='view_questions'))
 
-        bot.edit_message_text(
+        edit_menu(
             chat_id=call.message.chat.id,
             message_id=call.message.message_id,
             text=text,
@@ -601,37 +2444,20 @@ def view_question(call):
         )
 
     except Exception as e:
-        logger.error(f"Error viewing question: {e}")
+        logger.error("Error viewing question: %s", e, exc_info=True)
         bot.answer_callback_query(call.id, "Ошибка при загрузке вопроса")
-    finally:
-        conn.close()
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith(('vote_up_', 'vote_neutral_', 'vote_down_')))
-def handle_vote(call):
-    conn = None
-    try:
-        # Разбираем callback data
-        if call.data.startswith('vote_up_'):
-            new_vote_type = 'up'
-            question_id = int(call.data.replace('vote_up_', ''))
-        elif call.data.startswith('vote_neutral_'):
-            new_vote_type = 'neutral'
-            question_id = int(call.data.replace('vote_neutral_', ''))
-        elif call.data.startswith('vote_down_'):
-            new_vote_type = 'down'
-            question_id = int(call.data.replace('vote_down_', ''))
-        else:
-            logger.error(f"Invalid vote callback: {call.data}")
-            return
-
-        user_id = call.from_user.id
-
-        conn = sqlite3.connect('elders_council.db', check_same_thread=False)
+# Запись голоса и пересчет рейтинга вопроса
+def apply_vote(user_id, question_id, new_vote_type):
+    with write_connection() as conn:
         cursor = conn.cursor()
 
+        # Голоса за архивный вопрос хранятся в архивных таблицах
+        questions_table, votes_table = get_question_tables(cursor, question_id)
+
         # Получаем текущий голос пользователя
-        cursor.execute('SELECT vote_type FROM user_votes WHERE user_id=? AND question_id=?',
+        cursor.execute(f'SELECT vote_type FROM {votes_table} WHERE user_id=? AND question_id=?',
                        (user_id, question_id))
         existing_vote = cursor.fetchone()
 
@@ -639,21 +2465,40 @@ def handle_vote(call):
         if existing_vote and existing_vote[0] == new_vote_type:
             new_vote_type = 'neutral'
 
+        # Событие журнала голосов: на сколько изменились голоса «за» и «против»
+        old_vote_type = existing_vote[0] if existing_vote else 'neutral'
+        delta_up = (new_vote_type == 'up') - (old_vote_type == 'up')
+        delta_down = (new_vote_type == 'down') - (old_vote_type == 'down')
+        event = None
+        if delta_up or delta_down:
+            created_at = time.time()
+            cursor.execute('''
+            INSERT INTO vote_events (question_id, user_id, vote_type, delta_up, delta_down, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ''', (question_id, user_id, new_vote_type, delta_up, delta_down, created_at))
+            event = (cursor.lastrowid, question_id, delta_up, delta_down, created_at)
+            if delta_up + delta_down == 1:
+                bump_daily_stats(cursor, votes=1, votes_up=delta_up, votes_down=delta_down)
+            elif delta_up + delta_down == 0:
+                bump_daily_stats(cursor, vote_changes=1)
+            else:
+                bump_daily_stats(cursor, vote_retractions=1)
+
         # Удаляем старый голос
-        cursor.execute('DELETE FROM user_votes WHERE user_id=? AND question_id=?',
+        cursor.execute(f'DELETE FROM {votes_table} WHERE user_id=? AND question_id=?',
                        (user_id, question_id))
 
         # Если выбран не neutral, добавляем новый голос
         if new_vote_type != 'neutral':
-            cursor.execute('INSERT INTO user_votes (user_id, question_id, vote_type) VALUES (?,?,?)',
+            cursor.execute(f'INSERT INTO {votes_table} (user_id, question_id, vote_type) VALUES (?,?,?)',
                            (user_id, question_id, new_vote_type))
 
         # Пересчитываем общий рейтинг вопроса
-        cursor.execute('''
+        cursor.execute(f'''
             SELECT 
                 SUM(CASE WHEN vote_type = 'up' THEN 1 ELSE 0 END) -
                 SUM(CASE WHEN vote_type = 'down' THEN 1 ELSE 0 END) as net_votes
-            FROM user_votes 
+            FROM {votes_table} 
             WHERE question_id=?
         ''', (question_id,))
 
@@ -661,23 +2506,41 @@ def handle_vote(call):
         new_votes = result[0] if result[0] is not None else 0
 
         # Обновляем рейтинг вопроса
-        cursor.execute('UPDATE questions SET votes=? WHERE question_id=?',
+        cursor.execute(f'UPDATE {questions_table} SET votes=? WHERE question_id=?',
                        (new_votes, question_id))
 
-        conn.commit()
+    # В движок трендов событие попадает после коммита
+    engine = current_tenant().trending
+    if event and engine is not None:
+        engine.record(*event)
+
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith(('vote_up_', 'vote_neutral_', 'vote_down_')))
+def handle_vote(call):
+    try:
+        # Разбираем callback data
+        if call.data.startswith('vote_up_'):
+            new_vote_type = 'up'
+            question_id = int(call.data.replace('vote_up_', ''))
+        elif call.data.startswith('vote_neutral_'):
+            new_vote_type = 'neutral'
+            question_id = int(call.data.replace('vote_neutral_', ''))
+        elif call.data.startswith('vote_down_'):
+            new_vote_type = 'down'
+            question_id = int(call.data.replace('vote_down_', ''))
+        else:
+            logger.error("Invalid vote callback: %s", call.data)
+            return
+
+        apply_vote(call.from_user.id, question_id, new_vote_type)
         bot.answer_callback_query(call.id, "Голос учтён!")
 
         # Обновляем отображение вопроса
         view_question(call)
 
     except Exception as e:
-        logger.error(f"Vote error: {e}", exc_info=True)
+        logger.error("Vote error: %s", e, exc_info=True)
         bot.answer_callback_query(call.id, "Ошибка голосования")
-        if conn:
-            conn.rollback()
-    finally:
-        if conn:
-            conn.close()
 
 
 # Остальные функции (answer_question, process_answer, view_questions, handle_questions_pagination,
@@ -689,12 +2552,10 @@ def answer_question(call):
     user_id = call.from_user.id
 
     # Проверяем, является ли пользователь экспертом или модератором
-    conn = sqlite3.connect('elders_council.db', check_same_thread=False)
-    cursor = conn.cursor()
+    cursor = get_read_connection(max_staleness=0).cursor()
     cursor.execute('SELECT role FROM users WHERE user_id = ?', (user_id,))
     result = cursor.fetchone()
     user_role = result[0] if result else 'user'
-    conn.close()
 
     if user_role not in ['ekspert', 'moder']:
         bot.answer_callback_query(call.id, "Только эксперты могут отвечать на вопросы")
@@ -723,27 +2584,55 @@ def process_answer(message, question_id, answerer_name, chat_id):
         bot.register_next_step_handler(msg, process_answer, question_id, answerer_name, chat_id)
         return
 
-    conn = sqlite3.connect('elders_council.db', check_same_thread=False)
-    cursor = conn.cursor()
-
     try:
-        # Добавляем ответ в базу данных
-        cursor.execute('''
-        INSERT INTO answers (question_id, user_id, answer_text, timestamp)
-        VALUES (?, ?, ?, ?)
-        ''', (question_id, user_id, answer_text, datetime.now()))
-
-        # Помечаем вопрос как отвеченный
-        cursor.execute('''
-        UPDATE questions 
-        SET is_answered = TRUE 
-        WHERE question_id = ?
-        ''', (question_id,))
-
-        conn.commit()
+        with write_connection() as conn:
+            cursor = conn.cursor()
+            answered_at = datetime.now()
+
+            # Задержка ответа: от времени вопроса до ответа, в секундах
+            cursor.execute('''
+            SELECT is_answered, (julianday(?) - julianday(timestamp)) * 86400 FROM questions WHERE question_id = ?
+            UNION ALL
+            SELECT is_answered, (julianday(?) - julianday(timestamp)) * 86400 FROM questions_archive
+            WHERE question_id = ?
+            ''', (answered_at, question_id, answered_at, question_id))
+            is_answered, latency = cursor.fetchone() or (True, None)
+            latency = latency or 0
+
+            # Добавляем ответ в базу данных
+            cursor.execute('''
+            INSERT INTO answers (question_id, user_id, answer_text, timestamp)
+            VALUES (?, ?, ?, ?)
+            ''', (question_id, user_id, answer_text, answered_at))
+
+            if is_answered:
+                bump_daily_stats(cursor, answers=1)
+            else:
+                bump_daily_stats(cursor, answers=1, first_answers=1, first_answer_latency=latency)
+            cursor.execute('''
+            INSERT INTO expert_stats (user_id, answers, answer_latency, max_answer_latency, last_answer_at)
+            VALUES (?, 1, ?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET
+                answers = answers + 1,
+                answer_latency = answer_latency + excluded.answer_latency,
+                max_answer_latency = MAX(max_answer_latency, excluded.max_answer_latency),
+                last_answer_at = excluded.last_answer_at
+            ''', (user_id, latency, latency, answered_at))
+
+            # Помечаем вопрос как отвеченный
+            cursor.execute('''
+            UPDATE questions 
+            SET is_answered = TRUE 
+            WHERE question_id = ?
+            ''', (question_id,))
 
         # Получаем текст вопроса для уведомления
-        cursor.execute('SELECT question_text FROM questions WHERE question_id = ?', (question_id,))
+        cursor = get_read_connection(max_staleness=0).cursor()
+        cursor.execute('''
+        SELECT question_text FROM questions WHERE question_id = ?
+        UNION ALL
+        SELECT question_text FROM questions_archive WHERE question_id = ?
+        ''', (question_id, question_id))
         question_result = cursor.fetchone()
         question_text = question_result[0] if question_result else "Неизвестный вопрос"
 
@@ -755,17 +2644,15 @@ def process_answer(message, question_id, answerer_name, chat_id):
             bot.delete_message(chat_id, message.message_id)
             bot.delete_message(chat_id, message.message_id - 1)
         except Exception as e:
-            logger.debug(f"Ошибка при удалении сообщений: {e}")
+            logger.debug("Ошибка при удалении сообщений: %s", e)
 
         # Показываем главное меню
         bot.send_message(chat_id, "✅ Ваш ответ успешно добавлен.")
         show_main_menu(message)
 
     except Exception as e:
-        logger.error(f"Error saving answer: {e}")
+        logger.error("Error saving answer: %s", e, exc_info=True)
         bot.send_message(chat_id, "⚠ Произошла ошибка при сохранении ответа.")
-    finally:
-        conn.close()
 
 
 @bot.callback_query_handler(func=lambda call: call.data == 'view_questions')
@@ -773,13 +2660,12 @@ def view_questions(call, page=1):
     QUESTIONS_PER_PAGE = 5
     bot.answer_callback_query(call.id)
 
-    conn = sqlite3.connect('elders_council.db', check_same_thread=False)
-    cursor = conn.cursor()
+    # Новый одобренный вопрос может появиться в списке с задержкой до 5 секунд
+    cursor = get_read_connection(max_staleness=5).cursor()
 
     try:
         # Получаем общее количество одобренных вопросов
-        cursor.execute('SELECT COUNT(*) FROM questions WHERE is_approved = TRUE')
-        total_questions = cursor.fetchone()[0]
+        total_questions = count_listed_questions(cursor)
         total_pages = max(1, (total_questions + QUESTIONS_PER_PAGE - 1) // QUESTIONS_PER_PAGE)
 
         # Определяем текущую страницу
@@ -792,19 +2678,12 @@ def view_questions(call, page=1):
         offset = (page - 1) * QUESTIONS_PER_PAGE
 
         # Получаем вопросы для текущей страницы
-        cursor.execute('''
-        SELECT question_id, question_text, votes, is_answered 
-        FROM questions 
-        WHERE is_approved = TRUE
-        ORDER BY timestamp DESC
-        LIMIT ? OFFSET ?
-        ''', (QUESTIONS_PER_PAGE, offset))
-        questions = cursor.fetchall()
+        questions = fetch_questions_page(cursor, QUESTIONS_PER_PAGE, offset)
 
         keyboard = types.InlineKeyboardMarkup()
 
         if questions:
-            for q_id, q_text, votes, is_answered in questions:
+            for q_id, q_text, votes, is_answered, _ in questions:
                 status = "✅" if is_answered else "❓"
                 button_text = f"{q_text[:30]}..." if len(q_text) > 30 else q_text
                 keyboard.add(types.InlineKeyboardButton(
@@ -834,7 +2713,7 @@ def view_questions(call, page=1):
 
         text = f"Выберите вопрос для просмотра:\nСтраница {page} из {total_pages}" if questions else "ℹ Пока нет одобренных вопросов."
 
-        bot.edit_message_text(
+        edit_menu(
             chat_id=call.message.chat.id,
             message_id=call.message.message_id,
             text=text,
@@ -842,10 +2721,8 @@ def view_questions(call, page=1):
         )
 
     except Exception as e:
-        logger.error(f"Error viewing questions: {e}")
+        logger.error("Error viewing questions: %s", e, exc_info=True)
         bot.answer_callback_query(call.id, "Ошибка при загрузке вопросов")
-    finally:
-        conn.close()
 
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith('view_questions_page_'))
@@ -879,7 +2756,7 @@ def show_rules(call):
     keyboard = types.InlineKeyboardMarkup()
     keyboard.add(types.InlineKeyboardButton("🔙 Назад", callback_data='back_to_main'))
 
-    bot.edit_message_text(
+    edit_menu(
         chat_id=call.message.chat.id,
         message_id=call.message.message_id,
         text=rules_text,
@@ -897,23 +2774,504 @@ def check_pass(message):
     password = message.text.strip()
     user_id = message.from_user.id
 
-    conn = sqlite3.connect('elders_council.db', check_same_thread=False)
-    cursor = conn.cursor()
+    tenant = current_tenant()
 
-    if password == '123123':
-        cursor.execute('UPDATE users SET role = ? WHERE user_id = ?', ('moder', user_id))
-        conn.commit()
+    if password == tenant.setting('MODER_PASSWORD', '123123'):
+        with write_connection() as conn:
+            conn.execute('UPDATE users SET role = ? WHERE user_id = ?', ('moder', user_id))
         bot.send_message(message.chat.id, text='Теперь вы модератор!')
-    elif password == '321321':
-        cursor.execute('UPDATE users SET role = ? WHERE user_id = ?', ('ekspert', user_id))
-        conn.commit()
+    elif password == tenant.setting('EXPERT_PASSWORD', '321321'):
+        with write_connection() as conn:
+            conn.execute('UPDATE users SET role = ? WHERE user_id = ?', ('ekspert', user_id))
         bot.send_message(message.chat.id, text='Теперь вы эксперт!')
     else:
         bot.send_message(message.chat.id, text='Неверный пароль!')
 
-    conn.close()
+
+STATS_DAYS = 7
+STATS_TOP_EXPERTS = 5
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "—"
+    if round(seconds) < 60:
+        return f"{seconds:.0f} с"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f} мин"
+    if seconds < 86400:
+        return f"{seconds / 3600:.1f} ч"
+    return f"{seconds / 86400:.1f} дн"
 
 
+# Сводка для /stats только из роллапов: счетчик очереди, STATS_DAYS строк daily_stats по ключу
+# и STATS_TOP_EXPERTS строк expert_stats по индексу — объем чтения не зависит от размера БД
+def build_stats_report(cursor):
+    cursor.execute("SELECT value FROM stat_counters WHERE name = 'moderation_backlog'")
+    backlog = (cursor.fetchone() or (0,))[0]
+    cursor.execute('''
+    SELECT q.timestamp FROM moderation_queue m JOIN questions q ON q.question_id = m.question_id
+    ORDER BY m.question_id LIMIT 1
+    ''')
+    oldest = cursor.fetchone()
+
+    since = (datetime.now().date() - timedelta(days=STATS_DAYS - 1)).isoformat()
+    cursor.execute('''
+    SELECT day, questions_asked, questions_approved, questions_rejected, answers,
+           first_answers, first_answer_latency, votes, votes_up, votes_down, vote_changes, vote_retractions
+    FROM daily_stats WHERE day >= ? ORDER BY day
+    ''', (since,))
+    days = cursor.fetchall()
+
+    cursor.execute('''
+    SELECT e.user_id, COALESCE(u.first_name, u.username, e.user_id), e.answers,
+           e.answer_latency / e.answers, e.max_answer_latency
+    FROM expert_stats e LEFT JOIN users u ON u.user_id = e.user_id
+    ORDER BY e.answers DESC LIMIT ?
+    ''', (STATS_TOP_EXPERTS,))
+    experts = cursor.fetchall()
+
+    return {
+        'backlog': backlog,
+        'oldest_pending': oldest[0] if oldest else None,
+        'days': days,
+        'experts': experts,
+    }
+
+
+def format_stats_report(report):
+    today = datetime.now().date().isoformat()
+    totals = [sum(row[column] for row in report['days']) for column in range(1, 12)]
+    today_row = next((row for row in report['days'] if row[0] == today), (today,) + (0,) * 11)
+    lines = [
+        "📊 Статистика",
+        "",
+        f"📥 Очередь модерации: {report['backlog']}",
+    ]
+    if report['oldest_pending']:
+        lines.append(f"   ждет дольше всех с {str(report['oldest_pending'])[:16]}")
+    for title, row in (("Сегодня", today_row[1:]), (f"За {STATS_DAYS} дней", totals)):
+        (asked, approved, rejected, answers, first_answers, latency,
+         votes, votes_up, votes_down, changes, retractions) = row
+        lines += [
+            "",
+            f"📅 {title}:",
+            f"   вопросов {asked}, одобрено {approved}, отклонено {rejected}",
+            f"   ответов {answers}, первый ответ в среднем через "
+            f"{format_duration(latency / first_answers if first_answers else None)}",
+            f"   новых голосов {votes} (👍 {votes_up}, 👎 {votes_down}), изменено {changes}, отозвано {retractions}",
+        ]
+    if report['experts']:
+        lines += ["", "🎓 Эксперты:"]
+        for _, name, answers, average, longest in report['experts']:
+            lines.append(f"   {name}: ответов {answers}, в среднем {format_duration(average)}, "
+                         f"дольше всего {format_duration(longest)}")
+    return '\n'.join(lines)
+
+
+# Полный отчет в CSV: все дни и все эксперты из роллапов
+def export_stats_csv(cursor):
+    output = io.StringIO()
+    writer = csv.writer(output)
+    cursor.execute('''
+    SELECT day, questions_asked, questions_approved, questions_rejected, answers,
+           first_answers, first_answer_latency, votes, votes_up, votes_down, vote_changes, vote_retractions
+    FROM daily_stats ORDER BY day
+    ''')
+    writer.writerow(['day', 'questions_asked', 'questions_approved', 'questions_rejected', 'answers',
+                     'first_answers', 'avg_first_answer_latency_s', 'votes', 'votes_up', 'votes_down',
+                     'vote_changes', 'vote_retractions'])
+    for row in cursor.fetchall():
+        writer.writerow(row[:6] + (round(row[6] / row[5]) if row[5] else '',) + row[7:])
+
+    writer.writerow([])
+    cursor.execute('''
+    SELECT e.user_id, u.username, u.first_name, e.answers, e.answer_latency / e.answers,
+           e.max_answer_latency, e.last_answer_at
+    FROM expert_stats e LEFT JOIN users u ON u.user_id = e.user_id
+    ORDER BY e.answers DESC
+    ''')
+    writer.writerow(['expert_id', 'username', 'first_name', 'answers', 'avg_answer_latency_s',
+                     'max_answer_latency_s', 'last_answer_at'])
+    for row in cursor.fetchall():
+        writer.writerow(row[:4] + (round(row[4]), round(row[5]), row[6]))
+    return output.getvalue()
+
+
+def is_moderator(user_id):
+    cursor = get_read_connection(max_staleness=0).cursor()
+    cursor.execute('SELECT role FROM users WHERE user_id = ?', (user_id,))
+    result = cursor.fetchone()
+    return bool(result) and result[0] == 'moder'
+
+
+@bot.message_handler(commands=['stats'])
+def show_stats(message):
+    if not is_moderator(message.from_user.id):
+        bot.send_message(message.chat.id, "Статистика доступна только модераторам")
+        return
+
+    report = build_stats_report(get_read_connection(max_staleness=0).cursor())
+    keyboard = types.InlineKeyboardMarkup()
+    keyboard.add(types.InlineKeyboardButton("📄 Выгрузить отчет (CSV)", callback_data='stats_export'))
+    bot.send_message(message.chat.id, format_stats_report(report), reply_markup=keyboard)
+
+
+@bot.callback_query_handler(func=lambda call: call.data == 'stats_export')
+def export_stats(call):
+    if not is_moderator(call.from_user.id):
+        bot.answer_callback_query(call.id, "Статистика доступна только модераторам")
+        return
+
+    bot.answer_callback_query(call.id)
+    report = export_stats_csv(get_read_connection(max_staleness=0).cursor())
+    bot.send_document(call.message.chat.id, report.encode('utf-8'),
+                      visible_file_name=f"stats_{datetime.now():%Y-%m-%d}.csv")
+
+
+# Замер пропускной способности чтения (список, счетчик, топ) во время шторма голосов.
+# Сравниваются: соединение на каждый запрос без WAL (как было), свежие чтения в WAL и снимок в памяти
+def benchmark_reads(duration=5.0, readers=4, writers=4, questions=20000, users=2000):
+    workdir = os.getcwd()
+    modes = [
+        ('новое соединение на запрос, без WAL', None),
+        ('WAL, свежие чтения (max_staleness=0)', 0),
+        ('WAL, снимок в памяти (max_staleness=5)', 5),
+    ]
+
+    print(f"Вопросов: {questions}, читателей: {readers}, писателей: {writers}, {duration:.0f} с на режим")
+    for title, staleness in modes:
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            close_connections()
+            try:
+                init_db()
+                conn = sqlite3.connect('elders_council.db')
+                if staleness is None:
+                    conn.execute('PRAGMA journal_mode=DELETE')
+                now = datetime.now()
+                conn.executemany(
+                    'INSERT INTO questions (user_id, question_text, is_approved, timestamp) VALUES (?, ?, TRUE, ?)',
+                    [(i % users, f'Вопрос номер {i}', now - timedelta(minutes=i)) for i in range(questions)])
+                conn.commit()
+                conn.close()
+
+                stop = threading.Event()
+                counts = Counter()
+
+                def read_loop():
+                    rng = random.Random()
+                    while not stop.is_set():
+                        if staleness is None:
+                            conn = sqlite3.connect('elders_council.db', timeout=30)
+                        else:
+                            conn = get_read_connection(max_staleness=staleness)
+                        cursor = conn.cursor()
+                        count_listed_questions(cursor)
+                        fetch_questions_page(cursor, 5, rng.randrange(questions // 5) * 5)
+                        fetch_top_questions(cursor)
+                        if staleness is None:
+                            conn.close()
+                        counts['reads'] += 1
+
+                def write_loop():
+                    rng = random.Random()
+                    while not stop.is_set():
+                        apply_vote(rng.randrange(users), rng.randrange(1, questions + 1),
+                                   rng.choice(('up', 'down', 'neutral')))
+                        counts['writes'] += 1
+
+                threads = [threading.Thread(target=read_loop) for _ in range(readers)]
+                threads += [threading.Thread(target=write_loop) for _ in range(writers)]
+                for thread in threads:
+                    thread.start()
+                time.sleep(duration)
+                stop.set()
+                for thread in threads:
+                    thread.join()
+
+                print(f"  {title}: чтений {counts['reads'] / duration:.0f}/с, "
+                      f"голосов {counts['writes'] / duration:.0f}/с")
+            finally:
+                close_connections()
+                os.chdir(workdir)
+
+
+# Фоновый прогрев: компиляция фильтра и загрузка индекса дубликатов.
+# Пока индекс не готов, is_duplicate_question работает через difflib.
+# При нескольких арендаторах в startup_timings попадает самый долгий прогрев
+def run_warmup_task(tenant, name, task):
+    started = time.perf_counter()
+    try:
+        with use_tenant(tenant):
+            task()
+    except Exception as e:
+        logger.error("Ошибка прогрева (%s, %s): %s", tenant.name, name, e)
+    startup_timings[name] = max(startup_timings.get(name, 0), time.perf_counter() - started)
+
+
+def start_warmup():
+    threads = []
+    for tenant in tenants:
+        for name, task in (('bad_words', get_bad_words_pattern), ('duplicate_index', init_duplicate_index),
+                           ('trending', init_trending)):
+            thread = threading.Thread(target=run_warmup_task, args=(tenant, name, task),
+                                      name=f'warmup-{tenant.name}-{name}', daemon=True)
+            thread.start()
+            threads.append(thread)
+    return threads
+
+
+# Подготовка к обработке обновлений: схема БД синхронно, тяжелые задачи — в фоне
+def startup():
+    startup_timings['imports'] = STARTUP_IMPORTED - STARTUP_STARTED
+
+    started = time.perf_counter()
+    for tenant in tenants:
+        with use_tenant(tenant):
+            schema_changed = init_db()
+            logger.info("Схема БД обновлена" if schema_changed else "Версия схемы БД совпадает, DDL пропущен")
+    startup_timings['init_db'] = time.perf_counter() - started
+
+    threads = start_warmup()
+    threading.Thread(target=run_archive_scheduler, name='archive', daemon=True).start()
+    threading.Thread(target=run_digest_scheduler, name='digest', daemon=True).start()
+    if STATS_LOG_INTERVAL_MINUTES > 0:
+        threading.Thread(target=run_stats_logger, name='stats-log', daemon=True).start()
+    startup_timings['ready'] = time.perf_counter() - STARTUP_STARTED
+    return threads
+
+
+def measure_startup():
+    threads = startup()
+    ready = startup_timings['ready']
+    for thread in threads:
+        thread.join()
+    warmed = time.perf_counter() - STARTUP_STARTED
+
+    print("Холодный старт:")
+    print(f"  импорт модулей и регистрация обработчиков: {startup_timings['imports'] * 1000:.1f} мс")
+    print(f"  схема БД:                                   {startup_timings['init_db'] * 1000:.1f} мс")
+    print(f"  готов к обработке обновлений через:         {ready * 1000:.1f} мс")
+    print("Фоновый прогрев:")
+    print(f"  фильтр запрещенных слов:                    {startup_timings.get('bad_words', 0) * 1000:.1f} мс")
+    print(f"  индекс дубликатов:                          {startup_timings.get('duplicate_index', 0) * 1000:.1f} мс")
+    print(f"  движок трендов:                             {startup_timings.get('trending', 0) * 1000:.1f} мс")
+    print(f"  прогрев завершен через:                     {warmed * 1000:.1f} мс")
+
+
+# Пул обработчиков одного арендатора поверх общего пула потоков. Каждая задача (обработчик,
+# продолжение register_next_step_handler) выполняется в контексте своего арендатора; ошибки
+# копятся здесь, чтобы опрос Telegram другого арендатора их не видел
+class TenantPool:
+    def __init__(self, tenant, pool):
+        self.tenant = tenant
+        self.pool = pool
+        self.exception_event = threading.Event()
+        self.exception_info = None
+
+    def put(self, func, *args, **kwargs):
+        self.pool.put(self.run, func, args, kwargs)
+
+    def run(self, func, args, kwargs):
+        with use_tenant(self.tenant):
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                handler = self.tenant.bot.exception_handler
+                if handler is None or not handler.handle(e):
+                    self.exception_info = e
+                    self.exception_event.set()
+
+    def raise_exceptions(self):
+        if self.exception_event.is_set():
+            raise self.exception_info
+
+    def clear_exceptions(self):
+        self.exception_event.clear()
+
+    def close(self):
+        pass
+
+
+# Бот арендатора: свой токен и антифлуд, общие с ботом по умолчанию обработчики и фильтры
+def create_tenant_bot(tenant, pool):
+    tenant_bot = telebot.TeleBot(tenant.setting('BOT_TOKEN'), use_class_middlewares=True, num_threads=0)
+    template = default_tenant.bot
+    for name, value in vars(template).items():
+        if name.endswith('_handlers') and isinstance(value, list):
+            setattr(tenant_bot, name, value)
+    tenant_bot.custom_filters = template.custom_filters
+    tenant_bot.setup_middleware(log_context_middleware)
+    tenant.throttle_middleware = ThrottleMiddleware()
+    tenant_bot.setup_middleware(tenant.throttle_middleware)
+    tenant_bot.worker_pool = TenantPool(tenant, pool)
+    return tenant_bot
+
+
+# Арендаторы из каталога: каждый подкаталог с файлом .env (в нем обязателен свой BOT_TOKEN) — отдельный совет.
+# В подкаталоге лежат его elders_council.db, true_list.txt и индекс дубликатов
+def load_tenants(root, pool):
+    loaded = []
+    tokens = {}
+    for name in sorted(os.listdir(root)):
+        env_path = os.path.join(root, name, '.env')
+        if not os.path.isfile(env_path):
+            continue
+        tenant_settings = dotenv_values(env_path)
+        # Токен не наследуется из окружения процесса: два опроса с одним токеном получают 409 Conflict
+        token = tenant_settings.get('BOT_TOKEN')
+        if not token:
+            raise SystemExit(f"В {env_path} не задан BOT_TOKEN")
+        if token in tokens:
+            raise SystemExit(f"У арендаторов {tokens[token]} и {name} одинаковый BOT_TOKEN")
+        tokens[token] = name
+        tenant = Tenant(name, os.path.join(root, name), {**os.environ, **tenant_settings})
+        tenant.bot = create_tenant_bot(tenant, pool)
+        loaded.append(tenant)
+    return loaded
+
+
+# Несколько советов в одном процессе: у каждого бота свой поток опроса Telegram,
+# обработчики всех ботов выполняются общим пулом из WORKER_THREADS потоков
+def run_tenants(root):
+    pool = telebot.util.ThreadPool(default_tenant.bot, num_threads=WORKER_THREADS)
+    tenants[:] = load_tenants(root, pool)
+    if not tenants:
+        raise SystemExit(f"В {root} нет подкаталогов с файлом .env")
+    logger.info("Арендаторы: %s; потоков обработки: %s",
+                ', '.join(tenant.name for tenant in tenants), WORKER_THREADS)
+
+    startup()
+    threads = [threading.Thread(target=tenant.bot.polling, kwargs={'none_stop': True},
+                                name=f'polling-{tenant.name}', daemon=True) for tenant in tenants]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+# Память процесса: RSS (Linux) и объем, выделенный Python (tracemalloc)
+def memory_usage():
+    try:
+        with open('/proc/self/statm') as f:
+            rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        rss = None
+    return rss, tracemalloc.get_traced_memory()[0]
+
+
+# Замер памяти на каждого дополнительного арендатора: бот, БД с questions вопросами,
+# соединения, снимок, фильтр и индекс дубликатов. Списки запрещенных слов у всех одинаковые,
+# поэтому фильтр компилируется один раз
+def measure_tenants(count=20, questions=1000):
+    with open(default_tenant.bad_words_path, encoding='utf-8') as f:
+        bad_words = f.read()
+    load_numpy()
+    tracemalloc.start()
+    pool = telebot.util.ThreadPool(default_tenant.bot, num_threads=WORKER_THREADS)
+    samples = [memory_usage()]
+
+    with tempfile.TemporaryDirectory() as root:
+        for number in range(1, count + 1):
+            directory = os.path.join(root, f'council_{number}')
+            os.mkdir(directory)
+            with open(os.path.join(directory, '.env'), 'w', encoding='utf-8') as f:
+                f.write(f'BOT_TOKEN={number}:measure\n')
+            with open(os.path.join(directory, 'true_list.txt'), 'w', encoding='utf-8') as f:
+                f.write(bad_words)
+
+        loaded = load_tenants(root, pool)
+        for tenant in loaded:
+            with use_tenant(tenant):
+                init_db()
+                with write_connection() as conn:
+                    conn.executemany(
+                        'INSERT INTO questions (user_id, question_text, is_approved, timestamp) VALUES (?, ?, TRUE, ?)',
+                        [(i, f'Вопрос {tenant.name} номер {i}', datetime.now()) for i in range(questions)])
+                get_bad_words_pattern()
+                init_duplicate_index()
+                get_read_connection(max_staleness=0)
+                get_read_connection(max_staleness=30)
+            samples.append(memory_usage())
+
+        # Сколько стоил бы фильтр, если бы каждый арендатор компилировал свой
+        re.purge()
+        before = tracemalloc.get_traced_memory()[0]
+        words = [line.strip() for line in bad_words.splitlines() if line.strip()]
+        unshared = re.compile(r'\b(' + '|'.join(map(re.escape, words)) + r')\b', re.IGNORECASE)
+        filter_size = tracemalloc.get_traced_memory()[0] - before
+        del unshared
+
+        for tenant in loaded:
+            with use_tenant(tenant):
+                close_connections()
+    tracemalloc.stop()
+    pool.close()
+
+    print(f"Арендаторов: {count}, вопросов в каждой БД: {questions}, "
+          f"скомпилированных фильтров: {len(bad_words_patterns)}")
+    first, last = samples[1], samples[-1]
+    if first[0] is not None:
+        print(f"  RSS: первый арендатор {(first[0] - samples[0][0]) / 2 ** 20:.2f} МБ, "
+              f"каждый следующий {(last[0] - first[0]) / (count - 1) / 2 ** 20:.2f} МБ")
+    print(f"  Python (tracemalloc): первый арендатор {(first[1] - samples[0][1]) / 2 ** 10:.0f} КБ, "
+          f"каждый следующий {(last[1] - first[1]) / (count - 1) / 2 ** 10:.0f} КБ")
+    print(f"  общий фильтр запрещенных слов экономит {filter_size / 2 ** 10:.0f} КБ на арендатора")
+
+
+STARTUP_IMPORTED = time.perf_counter()
+
 if __name__ == '__main__':
-    init_db()
-    bot.polling(none_stop=True)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Телеграм-бот «Совет старейшин»')
+    parser.add_argument('--benchmark-duplicates', action='store_true',
+                        help='замерить скорость поиска дубликатов на 100 000 синтетических вопросов')
+    parser.add_argument('--measure-startup', action='store_true',
+                        help='вывести отчет о времени холодного старта и прогрева и выйти')
+    parser.add_argument('--benchmark-digests', action='store_true',
+                        help='сравнить число исходящих сообщений в час без сводок и со сводками')
+    parser.add_argument('--benchmark-reads', action='store_true',
+                        help='замерить пропускную способность чтения во время шторма голосов')
+    parser.add_argument('--measure-tenants', action='store_true',
+                        help='замерить память на каждого дополнительного арендатора')
+    parser.add_argument('--tenants', metavar='DIR',
+                        help='обслуживать несколько советов: подкаталоги DIR с .env (BOT_TOKEN и настройки), '
+                             'своими elders_council.db и true_list.txt')
+    parser.add_argument('--recompute-scores', action='store_true',
+                        help='пересчитать рейтинги и тренды по всему журналу голосов (NumPy)')
+    parser.add_argument('--export-stats', metavar='FILE',
+                        help='выгрузить статистику из роллапов в CSV')
+    parser.add_argument('--archive', action='store_true',
+                        help='перенести старые отвеченные вопросы в архив и вывести отчет')
+    parser.add_argument('--archive-after-days', type=int, default=ARCHIVE_AFTER_DAYS,
+                        help='возраст вопроса в днях, после которого он архивируется')
+    args = parser.parse_args()
+
+    if args.benchmark_duplicates:
+        duplicate_model = load_duplicate_model()
+        benchmark_duplicates()
+    elif args.benchmark_digests:
+        benchmark_digests()
+    elif args.benchmark_reads:
+        benchmark_reads()
+    elif args.measure_startup:
+        measure_startup()
+    elif args.measure_tenants:
+        measure_tenants()
+    elif args.tenants:
+        run_tenants(args.tenants)
+    elif args.export_stats:
+        init_db()
+        with open(args.export_stats, 'w', encoding='utf-8', newline='') as f:
+            f.write(export_stats_csv(get_read_connection().cursor()))
+    elif args.recompute_scores:
+        init_db()
+        recompute_scores(report=True)
+    elif args.archive:
+        init_db()
+        archive_old_questions(args.archive_after_days, report=True)
+    else:
+        if not BOT_TOKEN:
+            parser.error("не задан BOT_TOKEN")
+        startup()
+        bot.polling(none_stop=True)
\ No newline at end of file